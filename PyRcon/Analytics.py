@@ -0,0 +1,409 @@
+'''
+Fleet-wide player statistics on NumPy arrays.
+
+A PlayerStats collects player rows (time, server, client number,
+player, ping, score) from polled consoles, status histories or
+collector results into flat columns.  Its reports run as vectorized
+NumPy operations over those columns rather than loops over nested
+player dictionaries, so millions of rows take seconds, not minutes.
+
+  stats = PlayerStats()
+  stats.poll(consoles)
+  stats.ping_percentiles()
+  stats.load_balance({'10.0.0.1:28960':'eu', ...})
+
+Servers are named 'host:port'.  NumPy is only needed by this module:
+
+  pip install numpy
+'''
+
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .Exceptions import NoResponseError, UsageError, ServerPasswordNotSet
+
+
+def _name(host,port):
+    return '%s:%s' % (host,port)
+
+
+def _int(value,default):
+    try:
+        return int(value)
+    except (TypeError,ValueError):
+        return default
+
+
+def _grouped_percentiles(groups,values,percentiles):
+    '''
+    :param: groups      - integer numpy array, group of each value
+    :param: values      - numpy array
+    :param: percentiles - sequence of floats between 0 and 100
+    :return: (group ids,matrix) with one row of percentiles per group
+
+    Linearly interpolated like numpy.percentile, for every group at once.
+    '''
+    order = numpy.lexsort((values,groups))
+    groups = groups[order]
+    values = values[order].astype(numpy.float64)
+    starts = numpy.flatnonzero(numpy.r_[True,groups[1:] != groups[:-1]])
+    counts = numpy.diff(numpy.r_[starts,len(groups)])
+    q = numpy.asarray(percentiles,dtype=numpy.float64) / 100.0
+    position = starts[:,None] + q[None,:] * (counts[:,None] - 1)
+    low = numpy.floor(position).astype(numpy.int64)
+    high = numpy.ceil(position).astype(numpy.int64)
+    fraction = position - low
+    return groups[starts],values[low] + (values[high] - values[low]) * fraction
+
+
+class PlayerStats(object):
+    '''
+    Columnar player samples with vectorized fleet reports.
+    '''
+    _NO_PING = -1
+    _NO_CLIENT = -1
+    _ERRORS = (NoResponseError,UsageError,ServerPasswordNotSet,
+               ValueError,IndexError,OSError)
+
+    def __init__(self):
+        if numpy is None:
+            raise ImportError('PyRcon.Analytics requires numpy')
+        self._lock = Lock()
+        self._when = array('d')
+        self._server = array('l')
+        self._client = array('l')
+        self._player = array('l')
+        self._ping = array('l')
+        self._score = array('l')
+        self._sample_when = array('d')
+        self._sample_server = array('l')
+        self._sample_players = array('l')
+        self._servers = []
+        self._server_ids = {}
+        self._players = []
+        self._player_ids = {}
+        self._columns = None
+
+    def __repr__(self):
+        return '<%s(%d rows,%d servers,%d players)>' % (self.__class__.__name__,
+                                                        len(self._when),
+                                                        len(self._servers),
+                                                        len(self._players))
+
+    def __len__(self):
+        return len(self._when)
+
+    def _intern(self,ids,names,name):
+        i = ids.get(name)
+        if i is None:
+            i = ids[name] = len(names)
+            names.append(name)
+        return i
+
+    def _add_row(self,when,sid,client,name,ping,score):
+        self._when.append(when)
+        self._server.append(sid)
+        self._client.append(client)
+        self._player.append(self._intern(self._player_ids,self._players,name))
+        self._ping.append(ping)
+        self._score.append(score)
+
+    def _add_sample(self,when,sid,players):
+        self._sample_when.append(when)
+        self._sample_server.append(sid)
+        self._sample_players.append(players)
+
+    def add(self,server,players,when=None):
+        '''
+        :param: server  - string 'host:port' naming the server
+        :param: players - dictionary as returned by RemoteConsole.players
+        :param: when    - float unix time of the sample, defaults to now
+
+        Rows without a numeric score are skipped; pings such as 'CNCT'
+        are kept as missing.
+        '''
+        if when is None:
+            when = time()
+        with self._lock:
+            sid = self._intern(self._server_ids,self._servers,server)
+            self._add_sample(when,sid,len(players))
+            for name,row in players.items():
+                score = _int(row.get('score'),None)
+                if score is None:
+                    continue
+                self._add_row(when,sid,
+                              _int(row.get('num'),self._NO_CLIENT),
+                              name,
+                              _int(row.get('ping'),self._NO_PING),
+                              score)
+            self._columns = None
+
+    def add_collected(self,servers):
+        '''
+        :param: servers - iterable of CollectedServer, as yielded by a
+                          ShardedCollector or held by a FleetStateReader
+
+        Servers whose status poll failed are skipped.
+        '''
+        for server in servers:
+            if 'status' in server.errors:
+                continue
+            self.add(_name(server.host,server.port),server.players,
+                     server.timestamp)
+
+    def add_history(self,server,history,window=None):
+        '''
+        :param: server  - string 'host:port' naming the server
+        :param: history - StatusHistory recorded for that server
+        :param: window  - float seconds to look back, default history.window
+
+        Client numbers are not kept by a StatusHistory and are loaded
+        as missing.
+        '''
+        timeline = history.player_count(window)
+        rows = history.rows(window)
+        with self._lock:
+            sid = self._intern(self._server_ids,self._servers,server)
+            for when,players in timeline:
+                self._add_sample(when,sid,players)
+            for when,name,ping,score in rows:
+                self._add_row(when,sid,self._NO_CLIENT,name,ping,score)
+            self._columns = None
+
+    def poll(self,consoles,concurrency=32):
+        '''
+        :param: consoles    - list of RemoteConsoles
+        :param: concurrency - integer servers polled at once
+        :return: dictionary of 'host:port' -> exception for failed polls
+        '''
+        def fetch(console):
+            try:
+                return console,console.players,None
+            except self._ERRORS as error:
+                return console,None,error
+
+        failed = {}
+        with ThreadPoolExecutor(max_workers=max(1,concurrency)) as pool:
+            for console,players,error in pool.map(fetch,consoles):
+                name = _name(console.host,console.port)
+                if error is not None:
+                    failed[name] = error
+                else:
+                    self.add(name,players)
+        return failed
+
+    def columns(self):
+        '''
+        :return: dictionary of column name -> numpy array, with 'server'
+                 and 'player' holding indices into servers and players
+        '''
+        with self._lock:
+            if self._columns is None:
+                self._columns = {
+                    'when':numpy.array(self._when,dtype=numpy.float64),
+                    'server':numpy.array(self._server,dtype=numpy.int64),
+                    'client':numpy.array(self._client,dtype=numpy.int64),
+                    'player':numpy.array(self._player,dtype=numpy.int64),
+                    'ping':numpy.array(self._ping,dtype=numpy.int64),
+                    'score':numpy.array(self._score,dtype=numpy.int64),
+                    'sample_when':numpy.array(self._sample_when,dtype=numpy.float64),
+                    'sample_server':numpy.array(self._sample_server,dtype=numpy.int64),
+                    'sample_players':numpy.array(self._sample_players,dtype=numpy.int64),
+                }
+            return self._columns
+
+    @property
+    def servers(self):
+        '''
+        List of server names, indexed by the 'server' column.
+        '''
+        return list(self._servers)
+
+    @property
+    def players(self):
+        '''
+        List of player names, indexed by the 'player' column.
+        '''
+        return list(self._players)
+
+    def _mean_pings(self):
+        '''
+        Returns (server ids,player ids,mean pings) for every player on
+        every server with at least one ping.
+        '''
+        c = self.columns()
+        valid = c['ping'] >= 0
+        width = max(1,len(self._players))
+        pairs,inverse = numpy.unique(c['server'][valid] * width + c['player'][valid],
+                                     return_inverse=True)
+        means = (numpy.bincount(inverse,weights=c['ping'][valid]) /
+                 numpy.bincount(inverse))
+        return pairs // width,pairs % width,means
+
+    def ping_percentiles(self,percentiles=(50,90,99)):
+        '''
+        :param: percentiles - sequence of floats between 0 and 100
+        :return: dictionary of server -> {percentile:ping}
+
+        Computed over every ping sample of the server.
+        '''
+        c = self.columns()
+        valid = c['ping'] >= 0
+        if not valid.any():
+            return {}
+        ids,values = _grouped_percentiles(c['server'][valid],c['ping'][valid],
+                                          percentiles)
+        return {self._servers[sid]:dict(zip(percentiles,row.tolist()))
+                for sid,row in zip(ids.tolist(),values)}
+
+    def ping_outliers(self,threshold=3.5,min_ping=100):
+        '''
+        :param: threshold - float robust z-score above which a player's
+                            mean ping is an outlier on its server
+        :param: min_ping  - integer mean ping below which no one is flagged
+        :return: list of (server,player,mean ping,z-score), worst first
+
+        The z-score is taken against the median and median absolute
+        deviation of the mean pings of the server's players, so a few
+        lagging players cannot hide themselves by raising the average.
+        '''
+        servers,players,means = self._mean_pings()
+        if not len(means):
+            return []
+        ids,medians = _grouped_percentiles(servers,means,(50,))
+        median = numpy.zeros(len(self._servers))
+        median[ids] = medians[:,0]
+        deviation = numpy.abs(means - median[servers])
+        ids,mads = _grouped_percentiles(servers,deviation,(50,))
+        mad = numpy.zeros(len(self._servers))
+        mad[ids] = mads[:,0]
+
+        excess = means - median[servers]
+        scale = mad[servers]
+        with numpy.errstate(divide='ignore',invalid='ignore'):
+            z = numpy.where(scale > 0,0.6745 * excess / scale,
+                            numpy.where(excess > 0,numpy.inf,0.0))
+        flagged = numpy.flatnonzero((z > threshold) & (means >= min_ping))
+        flagged = flagged[numpy.lexsort((means[flagged],z[flagged]))[::-1]]
+        return [(self._servers[servers[i]],self._players[players[i]],
+                 float(means[i]),float(z[i])) for i in flagged]
+
+    def score_rates(self,window=None):
+        '''
+        :param: window - float seconds to look back from the newest row,
+                         None uses every row
+        :return: (server ids,player ids,points per minute) numpy arrays
+
+        Only score increases count, so a score reset by a map change
+        does not produce a negative rate.  Players sampled once are
+        left out.
+        '''
+        c = self.columns()
+        when,score = c['when'],c['score']
+        width = max(1,len(self._players))
+        keys = c['server'] * width + c['player']
+        if window is not None and len(when):
+            recent = when >= when.max() - window
+            when,score,keys = when[recent],score[recent],keys[recent]
+        if len(keys) < 2:
+            empty = numpy.zeros(0,dtype=numpy.int64)
+            return empty,empty,numpy.zeros(0)
+
+        order = numpy.lexsort((when,keys))
+        keys,when,score = keys[order],when[order],score[order]
+        pairs,starts,inverse = numpy.unique(keys,return_index=True,
+                                            return_inverse=True)
+        ends = numpy.r_[starts[1:],len(keys)] - 1
+        same = keys[1:] == keys[:-1]
+        gains = numpy.where(same,numpy.clip(numpy.diff(score),0,None),0)
+        gained = numpy.bincount(inverse[1:],weights=gains,minlength=len(pairs))
+        span = when[ends] - when[starts]
+        sampled = span > 0
+        rates = 60.0 * gained[sampled] / span[sampled]
+        pairs = pairs[sampled]
+        return pairs // width,pairs % width,rates
+
+    def score_leaders(self,count=10,window=None):
+        '''
+        :param: count  - integer number of leaders returned
+        :param: window - float seconds to look back, None uses every row
+        :return: list of (server,player,points per minute), best first
+        '''
+        servers,players,rates = self.score_rates(window)
+        best = numpy.argsort(rates,kind='stable')[::-1][:count]
+        return [(self._servers[servers[i]],self._players[players[i]],
+                 float(rates[i])) for i in best]
+
+    def load_balance(self,regions,capacity=None):
+        '''
+        :param: regions  - dictionary of server -> region name, servers
+                           not in it are counted in region None
+        :param: capacity - integer slots per server, or dictionary of
+                           server -> slots, for fill ratios
+        :return: dictionary of region -> dictionary with the region's
+                 'servers', 'players', 'mean' and 'stddev' players per
+                 server, 'imbalance' (stddev / mean), 'fill' (players /
+                 slots, None without capacity) and its 'busiest' and
+                 'quietest' servers
+
+        Uses each server's most recent sample.
+        '''
+        c = self.columns()
+        sample_server = c['sample_server']
+        if not len(sample_server):
+            return {}
+        order = numpy.lexsort((c['sample_when'],sample_server))
+        ordered = sample_server[order]
+        last = numpy.flatnonzero(numpy.r_[ordered[1:] != ordered[:-1],True])
+        ids = ordered[last]
+        load = c['sample_players'][order][last].astype(numpy.float64)
+
+        names = [self._servers[sid] for sid in ids.tolist()]
+        labels = [regions.get(name) for name in names]
+        slots = None
+        if capacity is not None:
+            if isinstance(capacity,dict):
+                slots = numpy.array([capacity.get(n,0) for n in names],
+                                    dtype=numpy.float64)
+            else:
+                slots = numpy.full(len(names),float(capacity))
+
+        region_names = sorted(set(labels),key=lambda r:(r is None,str(r)))
+        index = {r:i for i,r in enumerate(region_names)}
+        group = numpy.array([index[r] for r in labels],dtype=numpy.int64)
+        n = len(region_names)
+        servers = numpy.bincount(group,minlength=n)
+        players = numpy.bincount(group,weights=load,minlength=n)
+        mean = players / servers
+        stddev = numpy.sqrt(numpy.bincount(group,weights=(load - mean[group]) ** 2,
+                                           minlength=n) / servers)
+        fill = None
+        if slots is not None:
+            total = numpy.bincount(group,weights=slots,minlength=n)
+            with numpy.errstate(divide='ignore',invalid='ignore'):
+                fill = numpy.where(total > 0,players / total,numpy.nan)
+
+        order = numpy.lexsort((load,group))
+        starts = numpy.searchsorted(group[order],numpy.arange(n))
+        ends = numpy.r_[starts[1:],len(order)] - 1
+
+        report = {}
+        for i,region in enumerate(region_names):
+            report[region] = {
+                'servers':int(servers[i]),
+                'players':int(players[i]),
+                'mean':float(mean[i]),
+                'stddev':float(stddev[i]),
+                'imbalance':float(stddev[i] / mean[i]) if mean[i] else 0.0,
+                'fill':None if fill is None else float(fill[i]),
+                'busiest':names[order[ends[i]]],
+                'quietest':names[order[starts[i]]],
+            }
+        return report
@@ -0,0 +1,199 @@
+'''
+Datagram capture and deterministic replay.
+
+Assigning a CaptureLog to a console's 'capture' attribute records
+every datagram it sends and receives, with its time relative to the
+start of the capture, in a compact binary file:
+
+  console.capture = CaptureLog('busy-server.cap')
+  console.players
+  console.capture.close()
+
+Assigning a ReplayTransport to a console's 'transport' attribute makes
+it talk to the captured server instead of the network.  Each request
+the console sends is matched against the next one in the capture and
+answered with the replies recorded after it, either with the original
+timing scaled by 'speed' or, with speed=None, as fast as the console
+reads them.  This allows the reply parsers to be profiled offline and
+reproducibly:
+
+  console.transport = ReplayTransport('busy-server.cap',speed=None)
+  console.players
+
+The rcon password is replaced by _REDACTED in every request before it
+is written, so capture files can be carried off the server, and a
+replay compares requests without their passwords.
+
+The file starts with _MAGIC followed by records of a '<dBH' header
+(seconds since the capture started, direction, payload length) and
+the payload bytes.
+'''
+
+from struct import Struct
+from threading import Lock
+from time import monotonic, sleep
+
+_OOB = b'\xff\xff\xff\xff'
+_RCON = b'rcon '
+_REDACTED = b'********'
+
+
+def redact(data):
+    '''
+    :param: data - bytes datagram
+    :return: bytes with the password of an rcon request replaced
+
+    Handles both the Quake '\xff\xff\xff\xffrcon' and the Call of Duty
+    prefix with a sequence byte before 'rcon'.  Other datagrams are
+    returned as they are.
+    '''
+    if not data.startswith(_OOB):
+        return data
+    start = data.find(_RCON,len(_OOB),len(_OOB) + 1 + len(_RCON))
+    if start < 0:
+        return data
+    start += len(_RCON)
+    end = data.find(b' ',start)
+    if end < 0:
+        end = len(data)
+    return data[:start] + _REDACTED + data[end:]
+
+
+class CaptureLog(object):
+    '''
+    Append-only binary log of datagrams.
+    '''
+    OUT = 0
+    IN = 1
+    _MAGIC = b'PyRconCap1\n'
+    _RECORD = Struct('<dBH')
+
+    def __init__(self,path):
+        '''
+        :param: path - string filename, truncated if it exists
+        '''
+        self.path = path
+        self._lock = Lock()
+        self._fp = open(path,'wb')
+        self._fp.write(self._MAGIC)
+        self._start = monotonic()
+
+    def __repr__(self):
+        return '<%s(%s)>' % (self.__class__.__name__,self.path)
+
+    def record(self,direction,data):
+        '''
+        :param: direction - CaptureLog.OUT or CaptureLog.IN
+        :param: data      - bytes datagram, requests are redacted
+        '''
+        if direction == self.OUT:
+            data = redact(data)
+        header = self._RECORD.pack(monotonic() - self._start,direction,len(data))
+        with self._lock:
+            self._fp.write(header)
+            self._fp.write(data)
+
+    def close(self):
+        '''
+        Flushes and closes the log.
+        '''
+        with self._lock:
+            self._fp.close()
+
+
+def read_capture(path):
+    '''
+    :param: path - string filename written by CaptureLog
+    :return: list of (seconds,direction,bytes) tuples
+    '''
+    with open(path,'rb') as fp:
+        data = fp.read()
+    if not data.startswith(CaptureLog._MAGIC):
+        raise ValueError('%s is not a capture log' % (path))
+    size = CaptureLog._RECORD.size
+    unpack = CaptureLog._RECORD.unpack_from
+    records = []
+    offset = len(CaptureLog._MAGIC)
+    while offset + size <= len(data):
+        when,direction,length = unpack(data,offset)
+        offset += size
+        records.append((when,direction,data[offset:offset + length]))
+        offset += length
+    return records
+
+
+class ReplayTransport(object):
+    '''
+    Feeds captured replies back to a console in place of a socket.
+    '''
+
+    def __init__(self,path,speed=1.0,strict=True):
+        '''
+        :param: path   - string filename written by CaptureLog
+        :param: speed  - float timing scale, 2.0 replays twice as fast,
+                         None delivers replies without any delay
+        :param: strict - bool, raise ValueError if a request differs
+                         from the captured one, passwords aside
+        '''
+        self.path = path
+        self.speed = speed
+        self.strict = strict
+        self._records = read_capture(path)
+        self._next = 0
+        self._pending = []
+        self._sent = None
+
+    def __repr__(self):
+        return '<%s(%s,%s)>' % (self.__class__.__name__,self.path,self.speed)
+
+    @property
+    def remaining(self):
+        '''
+        Number of captured requests not yet replayed.
+        '''
+        return len([r for r in self._records[self._next:]
+                    if r[1] == CaptureLog.OUT])
+
+    def transmit(self,data):
+        '''
+        :param: data - bytes request from the console
+
+        Queues the replies captured after the matching request.
+        '''
+        records = self._records
+        while self._next < len(records) and records[self._next][1] != CaptureLog.OUT:
+            self._next += 1
+        if self._next == len(records):
+            raise ValueError('capture exhausted',data)
+        when,_,captured = records[self._next]
+        if self.strict and redact(captured) != redact(data):
+            raise ValueError('request differs from capture',data,captured)
+        self._next += 1
+
+        self._pending = []
+        while self._next < len(records) and records[self._next][1] == CaptureLog.IN:
+            reply_when,_,reply = records[self._next]
+            self._pending.append((reply_when - when,reply))
+            self._next += 1
+        self._pending.reverse()
+        self._sent = monotonic()
+
+    def receive(self,timeout):
+        '''
+        :param: timeout - float seconds to wait for a datagram
+        :return: bytes datagram or None if none is due within timeout
+        '''
+        if self.speed is None:
+            if self._pending:
+                return self._pending.pop()[1]
+            return None
+
+        now = monotonic()
+        if self._pending:
+            due = self._sent + self._pending[-1][0] / self.speed
+            if due - now <= timeout:
+                if due > now:
+                    sleep(due - now)
+                return self._pending.pop()[1]
+        sleep(timeout)
+        return None
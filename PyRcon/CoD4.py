@@ -1,12 +1,16 @@
 
 from .QuakeRemoteConsole import BaseRemoteConsole
 from .Exceptions import *
-from time import sleep
+from .Subscriptions import DvarSubscriptions
+from time import sleep, monotonic
 
 class RemoteConsole(BaseRemoteConsole):
     '''
     '''
     _SEQUENCE=0x02
+    _TIMEOUTS = { 'map':         (0.25,3),
+                  'devmap':      (0.25,3),
+                  'map_restart': (0.25,2) }
     _maps = { 'mp_convoy':     'Ambush',
               'mp_backlot':    'Backlot',
               'mp_bloc':       'Bloc',
@@ -29,6 +33,23 @@ class RemoteConsole(BaseRemoteConsole):
               'mp_creek':      'Creek',
               'mp_killhouse':  'Killhouse' }
 
+    def __init__(self,password,hostname='localhost',port=28960,
+                 profile=None,metadata=None,history=None,connected=False):
+        '''
+        :param: password - string password for server
+        :param: hostname - string, name or IP address of server
+        :param: port     - integer, port number to contact on hostname
+        :param: profile  - LatencyProfile, may be shared between consoles
+        :param: metadata - MetadataCache for bindlist, channels, cmdlist,
+                           dvarlist and path, may be shared
+        :param: history  - StatusHistory recording every players poll
+        :param: connected - bool, connect() the UDP socket to the server
+        '''
+        super(RemoteConsole,self).__init__(password,hostname,port,profile,
+                                           connected)
+        self.metadata = metadata
+        self.history = history
+
     def __str__(self):
         return self.status
 
@@ -47,13 +68,15 @@ class RemoteConsole(BaseRemoteConsole):
             self._reply_header = bytes(data)
         return self._reply_header
 
-    def send(self,message,encoding='utf-8',timeout=0.05,retries=2):
+    def send(self,message,encoding='utf-8',timeout=None,retries=None):
         '''
 
         :param: message  - string holding command to send to server
         :param: encoding - string used to determine byte buffer [en|de]coding
-        :param: timeout  - float seconds to wait for a response 
-        :param: retries  - integer number of times to timeout before failing
+        :param: timeout  - float seconds to wait for a response, None
+                           picks one from the latency profile
+        :param: retries  - integer number of times to timeout before
+                           failing, None picks from the latency profile
 
         :return: string server response to client message
 
@@ -113,20 +136,55 @@ class RemoteConsole(BaseRemoteConsole):
         Note: filterfunc should return True for lines that should be
               kept and False for lines that should be ignored.
         '''
-        
+            
+        return self._lines(self.send(cmd),filterfunc)
+
+    def _lines(self,text,filterfunc=None):
+        '''
+        :param: text       - string server response
+        :param: filterfunc - function used to filter strings
+        :return: list of strings
+
+        Splits text by new-lines and filters them as _list() does.
+        '''
         if filterfunc is None:
             filterfunc = lambda x: len(x)
-            
-        return [x for x in self.send(cmd).split('\n') if filterfunc(x)]
+
+        return [x for x in text.split('\n') if filterfunc(x)]
 
     def _get_dvar_value(self,name):
         return self.dvardump(name)[name]    
 
+    @property
+    def subscriptions(self):
+        '''
+        The DvarSubscriptions shared by everything watching this
+        console's dvars, see PyRcon.Subscriptions.
+        '''
+        try:
+            return self._subscriptions
+        except AttributeError:
+            self._subscriptions = DvarSubscriptions(self)
+        return self._subscriptions
+
+    def _cached(self,name,fetch):
+        '''
+        :param: name  - string name of the metadata item
+        :param: fetch - callable that queries the server for it
+        :return: the item, from the metadata cache if there is one
+        '''
+        if self.metadata is None:
+            return fetch()
+        return self.metadata.get(self,name,fetch)
+
     @property
     def bindlist(self):
         '''
         A dictionary of Keyboard_Key,Command pairs.
         '''
+        return self._cached('bindlist',self._bindlist)
+
+    def _bindlist(self):
         l = {}
         for pair in self._list('bindlist'):
             if len(pair) == 0:
@@ -140,6 +198,9 @@ class RemoteConsole(BaseRemoteConsole):
         '''
         List of all "channels".
         '''
+        return self._cached('channels',self._channels)
+
+    def _channels(self):
         return self._list('con_channellist')
 
     @property
@@ -147,6 +208,9 @@ class RemoteConsole(BaseRemoteConsole):
         '''
         List of all visible "channels".
         '''
+        return self._cached('visible_channels',self._visible_channels)
+
+    def _visible_channels(self):
         return self._list('con_visiblechannellist')
     
     @property
@@ -154,6 +218,9 @@ class RemoteConsole(BaseRemoteConsole):
         '''
         Sorted list of commands supported by the server.
         '''
+        return self._cached('cmdlist',self._cmdlist)
+
+    def _cmdlist(self):
         cmds = self._list('cmdlist')[:-1]
         cmds.sort()
         return cmds
@@ -163,6 +230,9 @@ class RemoteConsole(BaseRemoteConsole):
         '''
         List of dvars without their current defined values.
         '''
+        return self._cached('dvarlist',self._dvarlist)
+
+    def _dvarlist(self):
         dvars = []
         for line in self._list('dvarlist')[:-1]:
             name,_,value = line.partition('"')
@@ -214,6 +284,9 @@ class RemoteConsole(BaseRemoteConsole):
         '''
         A list of paths used to search for in-game assets.
         '''
+        return self._cached('path',self._path)
+
+    def _path(self):
         p = []
         for line in self._list('path'):
             if line.startswith('/'):
@@ -224,11 +297,22 @@ class RemoteConsole(BaseRemoteConsole):
     def players(self):
         '''
         List of players currently connected.
+
+        If the console has a history, the players are recorded in it.
+        '''
+        players = self._parse_players(self._list('status'))
+        if self.history is not None:
+            self.history.record(players)
+        return players
+
+    def _parse_players(self,status):
+        '''
+        :param: status - list of lines of a 'status' response
+        :return: dictionary of player name -> dictionary of columns
         '''
-        status = self._list('status')
-        if len(status) < 3:
-            return {}
         players = {}
+        if len(status) < 3:
+            return players
         labels = status[1].split()
         nameidx = labels.index('name')
         for line in status[3:]:
@@ -278,9 +362,17 @@ class RemoteConsole(BaseRemoteConsole):
         dvars = self.dvardump()
         
         sleep(pause)
-        
+
+        return self._parse_info(self._list(which),dvars)
+
+    def _parse_info(self,lines,dvars):
+        '''
+        :param: lines - list of lines of a serverinfo/systeminfo response
+        :param: dvars - dictionary from dvardump() used to split run-on keys
+        :return: dictionary
+        '''
         d = {}
-        for entry in self._list(which)[1:]:
+        for entry in lines[1:]:
             fields = entry.split(maxsplit=1)
             if len(fields) == 2:
                 d.setdefault(fields[0],fields[1])
@@ -413,7 +505,7 @@ class RemoteConsole(BaseRemoteConsole):
 
         Removes a player from banned list.
         '''
-        result = r.send('unbanUser %s' % (playerName))
+        result = self.send('unbanUser %s' % (playerName))
 
         
     def kick(self,player):
@@ -425,7 +517,7 @@ class RemoteConsole(BaseRemoteConsole):
         If 'playerName' is 'all', all players are kicked from the server.
         '''
         
-        cmd = {True:'kickonly', False:'kickclient'}[issubstring(player,str)]
+        cmd = {True:'onlykick', False:'clientkick'}[issubclass(type(player),str)]
         
         results = self.send('%s %s' % (cmd,player))
 
@@ -524,8 +616,17 @@ class RemoteConsole(BaseRemoteConsole):
         matching the given name.
         '''
         
-        good = lambda t: len(t) and '==' not in t
-        dlist = self._list('dvardump %s' % name,good)
+        return self._parse_dvardump(self._list('dvardump %s' % name,
+                                                self._DVARDUMP_LINE))
+
+    _DVARDUMP_LINE = staticmethod(lambda t: len(t) and '==' not in t)
+
+    def _parse_dvardump(self,dlist):
+        '''
+        :param: dlist - list of lines of a 'dvardump' response, without
+                        blank and '====' separator lines
+        :return: dictionary of key/value pairs
+        '''
         total = int(dlist[-2].split()[0])
         dvars = {}
         for data in dlist[:-2]:
@@ -617,10 +718,13 @@ class RemoteConsole(BaseRemoteConsole):
         '''
         results = self.send('heartbeat')
         
-    def map(self,mapname,cheats=False):
+    def map(self,mapname,cheats=False,wait=False,timeout=90.0):
         '''
         :param: mapname - string 
         :param: cheats  - boolean
+        :param: wait    - boolean, wait for the map to finish loading
+        :param: timeout - float seconds to wait before MapLoadTimeout
+        :return: float seconds the load took if wait is True
         
         Directs the server to stop the current map and start the
         supplied mapname.  If cheats is True, the 'devmap' command
@@ -632,12 +736,121 @@ class RemoteConsole(BaseRemoteConsole):
         '''
         
         cmd = {True:'devmap',False:'map'}[cheats]
+
+        start = monotonic()
+
+        # the server answers once the load is done, a slow load can
+        # outlast send() and is then left to wait_until_ready
+        try:
+            results = self.send('%s %s' % (cmd,mapname))
+        except NoResponseError:
+            if not wait:
+                raise
+            results = ''
         
-        results = self.send('%s %s' % (cmd,mapname),timeout=0.25,retries=3)
-        
-        if results[-3].count('Error'):
+        if results.count("Can't find map"):
             raise FileNotFound(mapname)
 
+        if wait:
+            return self.wait_until_ready(mapname,timeout,start=start)
+
+    def change_map(self,mapname,gametype=None,cheats=False,timeout=90.0):
+        '''
+        :param: mapname  - string
+        :param: gametype - string, optional new g_gametype
+        :param: cheats   - boolean, see map()
+        :param: timeout  - float seconds to wait before MapLoadTimeout
+        :return: float seconds from the map command to the map being loaded
+
+        Switches to mapname, optionally changing the gametype first,
+        and returns as soon as the server is running the new map.
+        '''
+        if gametype is not None:
+            self.gametype = gametype
+        return self.map(mapname,cheats,wait=True,timeout=timeout)
+
+    def _serverid(self):
+        '''
+        The sv_serverid dvar, which the server changes on every map
+        load and restart, or None if it could not be read.
+        '''
+        try:
+            return self.dvardump('sv_serverid').get('sv_serverid')
+        except (NoResponseError,ValueError,IndexError):
+            return None
+
+    def _changed(self):
+        '''
+        Returns a callable that is True once sv_serverid differs from
+        its value now.  If it can't be read the callable is always
+        False, leaving a gap in the server's replies as the only sign
+        of the change.
+        '''
+        before = self._serverid()
+        if before is None:
+            return lambda:False
+        return lambda:self._serverid() not in (None,before)
+
+    def _next_rotation_map(self):
+        '''
+        The map map_rotate will load: the first one left in
+        sv_mapRotationCurrent or, once that is used up, the first one
+        in sv_mapRotation.  None if neither names a map.
+        '''
+        try:
+            dvars = self.dvardump('sv_mapRotation')
+        except (NoResponseError,ValueError,IndexError):
+            return None
+        for name in ('sv_mapRotationCurrent','sv_mapRotation'):
+            words = dvars.get(name,'').split()
+            for i,word in enumerate(words[:-1]):
+                if word.lower() == 'map':
+                    return words[i + 1]
+        return None
+
+    def wait_until_ready(self,mapname=None,timeout=90.0,interval=0.05,
+                         backoff=1.5,max_interval=1.0,start=None,
+                         changed=None):
+        '''
+        :param: mapname      - string map expected, None accepts any
+        :param: timeout      - float seconds to wait before MapLoadTimeout
+        :param: interval     - float seconds between the first polls
+        :param: backoff      - float factor the interval grows by per poll
+        :param: max_interval - float upper bound of the poll interval
+        :param: start        - float monotonic() time the change began,
+                               defaults to now
+        :param: changed      - callable, True once the server shows the
+                               change has happened, see _changed()
+        :return: float seconds from start until the server was ready
+
+        A server loading a map does not answer network traffic, so the
+        server is ready once it answers the out-of-band getinfo query
+        again (with the expected mapname, if one is given).  Polls begin
+        one interval after start and back off up to max_interval.
+
+        A server may act on a command in its next frame, after having
+        answered a poll from the old map.  With changed, a reply only
+        counts once the change has been observed: either a poll went
+        unanswered, or changed() returns True.
+        '''
+        if start is None:
+            start = monotonic()
+        deadline = start + timeout
+        gap = False
+        while True:
+            sleep(max(0.0,min(interval,deadline - monotonic())))
+            try:
+                info = self.getinfo()
+            except (NoResponseError,ValueError):
+                gap = True
+            else:
+                if mapname is None or info.get('mapname','').lower() == mapname.lower():
+                    if changed is None or gap or changed():
+                        return monotonic() - start
+            if monotonic() >= deadline:
+                raise MapLoadTimeout(mapname,timeout)
+            interval = min(interval * backoff,max_interval)
+
     def net_restart(self):
         '''
         Returns the results of the 'net_restart' command.
@@ -669,15 +882,23 @@ class RemoteConsole(BaseRemoteConsole):
         '''
         result = self.send('tell %s %s' % (playerName,message))
 
-    def next_map(self):
-        '''
+    def next_map(self,wait=False,timeout=90.0):
         '''
-        result = self.send('map_rotate')
+        :param: wait    - boolean, wait for the next map to finish loading
+        :param: timeout - float seconds to wait before MapLoadTimeout
+        :return: float seconds the load took if wait is True
 
-    def kick(self,player):
+        When waiting, the server is ready once it runs the map next in
+        its rotation and has been seen to change.
         '''
-        '''
-        result = self.send('kick %s' % player)
+        if wait:
+            mapname = self._next_rotation_map()
+            changed = self._changed()
+        start = monotonic()
+        result = self.send('map_rotate')
+        if wait:
+            return self.wait_until_ready(mapname,timeout,start=start,
+                                         changed=changed)
 
     def killserver(self):
         '''
@@ -687,18 +908,26 @@ class RemoteConsole(BaseRemoteConsole):
         '''
         result = self.send('killserver')
 
-    def restart(self,fast=False):
+    def restart(self,fast=False,wait=False,timeout=90.0):
         '''
-        :param: fast - bool
+        :param: fast    - bool
+        :param: wait    - bool, wait for the map to finish reloading
+        :param: timeout - float seconds to wait before MapLoadTimeout
+        :return: float seconds the restart took if wait is True
         
         If fast is True, calls fast_restart without re-reading assets.
         
         Otherwise, map_restart is used which re-read assets.
         '''
+        changed = self._changed() if wait else None
+        start = monotonic()
         if fast:
             result = self.send('fast_restart')
         else:
-            result = self.send('map_restart',timeout=0.25)
+            result = self.send('map_restart')
+        if wait:
+            return self.wait_until_ready(None,timeout,start=start,
+                                         changed=changed)
 
     def reset(self,dvarname):
         '''
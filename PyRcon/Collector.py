@@ -0,0 +1,319 @@
+'''
+Multi-process collector for very large fleets.
+
+Parsing 'status' and 'dvardump' replies for thousands of servers is
+CPU bound, and one Python process can only use one core for it.  A
+ShardedCollector splits the server list across a pool of worker
+processes.  Each worker drives all of its servers at once from a
+single thread with non-blocking sockets: it sends a command to every
+server in its shard, gathers replies as they arrive, parses them with
+the RemoteConsole parsers and moves on to the next command.
+
+Parsed results travel back to the parent as compact marshal encoded
+tuples over a pipe per worker, sent with send_bytes() so no pickling
+happens on either side.  The parent decodes each one into a
+CollectedServer.
+
+  collector = ShardedCollector(servers,processes=8,interval=30)
+  collector.start()
+  for server in collector.results():
+      print(server.address,len(server.players))
+'''
+
+import marshal
+import os
+import selectors
+from multiprocessing import Pipe, get_context
+from multiprocessing.connection import wait
+from socket import socket, getaddrinfo, AF_INET, AF_UNSPEC, SOCK_DGRAM
+from time import monotonic, sleep, time
+
+from .CoD4 import RemoteConsole
+
+
+class CollectedServer(object):
+    '''
+    One server's parsed poll results, decoded in the parent.
+    '''
+    __slots__ = ('host','port','timestamp','players','dvars',
+                 'serverinfo','errors')
+
+    def __init__(self,host,port,timestamp,players,dvars,serverinfo,errors):
+        self.host = host
+        self.port = port
+        self.timestamp = timestamp
+        self.players = players
+        self.dvars = dvars
+        self.serverinfo = serverinfo
+        self.errors = errors
+
+    def __repr__(self):
+        return '<%s(%s:%s,%d players,%d dvars,errors=%s)>' % (
+            self.__class__.__name__,self.host,self.port,
+            len(self.players),len(self.dvars),self.errors)
+
+    @property
+    def address(self):
+        return (self.host,self.port)
+
+
+def encode(host,port,timestamp,players,dvars,serverinfo,errors):
+    '''
+    :return: bytes, the marshal encoding of one server's results
+
+    Players are sent as a column label tuple and one value tuple per
+    player, dictionaries as flat key,value tuples.
+    '''
+    labels = ()
+    rows = ()
+    if players:
+        labels = tuple(next(iter(players.values())).keys())
+        rows = tuple(tuple(row.get(label,'') for label in labels)
+                     for row in players.values())
+    flat = lambda d: tuple(x for kv in d.items() for x in kv)
+    return marshal.dumps((host,port,timestamp,labels,rows,flat(dvars),
+                          flat(serverinfo),tuple(errors)))
+
+
+def decode(data):
+    '''
+    :param: data - bytes from encode()
+    :return: CollectedServer
+    '''
+    host,port,timestamp,labels,rows,dvars,info,errors = marshal.loads(data)
+    players = {}
+    if rows:
+        nameidx = labels.index('name')
+        for row in rows:
+            players.setdefault(row[nameidx],dict(zip(labels,row)))
+    unflat = lambda t: dict(zip(t[0::2],t[1::2]))
+    return CollectedServer(host,port,timestamp,players,unflat(dvars),
+                           unflat(info),dict(errors))
+
+
+def _exchange(requests,timeout,quiet,chunksz=2048):
+    '''
+    :param: requests - list of (socket,address,bytes,header) tuples
+    :param: timeout  - float seconds to wait for a first reply
+    :param: quiet    - float seconds of silence that ends a reply
+    :return: list of reply texts, None where nothing was received
+
+    Sends every request at once and collects all replies concurrently.
+    '''
+    selector = selectors.DefaultSelector()
+    chunks = [[] for _ in requests]
+    last = [None] * len(requests)
+    start = monotonic()
+    pending = set()
+    for i,(sock,address,data,header) in enumerate(requests):
+        try:
+            sock.sendto(data,address)
+        except OSError:
+            continue
+        selector.register(sock,selectors.EVENT_READ,i)
+        pending.add(i)
+
+    while pending:
+        now = monotonic()
+        deadlines = []
+        for i in list(pending):
+            end = (last[i] + quiet) if last[i] is not None else (start + timeout)
+            if end <= now:
+                pending.discard(i)
+                selector.unregister(requests[i][0])
+            else:
+                deadlines.append(end)
+        if not pending:
+            break
+        for key,_ in selector.select(min(deadlines) - now):
+            i = key.data
+            sock,_,_,header = requests[i]
+            while True:
+                try:
+                    data = sock.recv(chunksz)
+                except (BlockingIOError,InterruptedError):
+                    break
+                except OSError:
+                    break
+                if data.startswith(header):
+                    chunks[i].append(data[len(header):])
+                    last[i] = monotonic()
+    selector.close()
+    return [b''.join(c).decode(errors='replace') if c else None
+            for c in chunks]
+
+
+_PARSERS = {
+    'status':lambda c,text,dvars:c._parse_players(c._lines(text)),
+    'dvardump':lambda c,text,dvars:c._parse_dvardump(c._lines(text,c._DVARDUMP_LINE)),
+    'serverinfo':lambda c,text,dvars:c._parse_info(c._lines(text),dvars),
+}
+
+
+def _worker(conn,shard,commands,interval,timeout,quiet,cycles):
+    '''
+    Worker process body: polls its shard and sends encoded results to
+    the parent until cycles run out (None polls forever) or the parent
+    closes the pipe.
+    '''
+    consoles = []
+    sockets = []
+    for host,port,passwd in shard:
+        try:
+            family,_,_,_,address = getaddrinfo(host,port,AF_UNSPEC,SOCK_DGRAM)[0]
+        except OSError:
+            # left for sendto() to fail on, reported as no response
+            family,address = AF_INET,(host,port)
+        sock = socket(family,SOCK_DGRAM)
+        sock.setblocking(False)
+        console = RemoteConsole(passwd,host,port)
+        consoles.append((console,address))
+        sockets.append(sock)
+
+    def request(command):
+        return [(sock,address,
+                 console.prefix + bytes('%s %s' % (console.passwd,command),'utf-8'),
+                 console.reply_header)
+                for sock,(console,address) in zip(sockets,consoles)]
+
+    cycle = 0
+    try:
+        while cycles is None or cycle < cycles:
+            started = monotonic()
+            replies = {c:_exchange(request(c),timeout,quiet) for c in commands}
+            when = time()
+            for i,(console,_) in enumerate(consoles):
+                errors = []
+                parsed = {}
+                for command in commands:
+                    text = replies[command][i]
+                    if text is None:
+                        errors.append((command,'NoResponseError'))
+                        continue
+                    try:
+                        parsed[command] = _PARSERS[command](console,text,
+                                                            parsed.get('dvardump',{}))
+                    except (ValueError,IndexError,KeyError) as error:
+                        errors.append((command,error.__class__.__name__))
+                conn.send_bytes(encode(console.host,console.port,when,
+                                       parsed.get('status',{}),
+                                       parsed.get('dvardump',{}),
+                                       parsed.get('serverinfo',{}),
+                                       errors))
+            cycle += 1
+            if cycles is None or cycle < cycles:
+                sleep(max(0.0,interval - (monotonic() - started)))
+    except (BrokenPipeError,EOFError,KeyboardInterrupt):
+        pass
+    finally:
+        for sock in sockets:
+            sock.close()
+        conn.close()
+
+
+class ShardedCollector(object):
+    '''
+    Polls a large fleet from a pool of worker processes.
+    '''
+    _COMMANDS = ('status','dvardump','serverinfo')
+
+    def __init__(self,servers,processes=None,interval=30.0,
+                 commands=_COMMANDS,timeout=1.0,quiet=0.1):
+        '''
+        :param: servers   - list of (host,port,password) tuples
+        :param: processes - integer worker count, default os.cpu_count()
+        :param: interval  - float seconds between polls of each shard
+        :param: commands  - tuple of 'status', 'dvardump', 'serverinfo';
+                            serverinfo run-on keys are only resolved
+                            when dvardump is also polled
+        :param: timeout   - float seconds to wait for a first reply
+        :param: quiet     - float seconds of silence that ends a reply
+        '''
+        for command in commands:
+            if command not in self._COMMANDS:
+                raise ValueError('%s not one of %s' % (command,self._COMMANDS))
+        self.servers = list(servers)
+        self.processes = max(1,min(processes or os.cpu_count() or 1,
+                                   len(self.servers) or 1))
+        self.interval = interval
+        self.commands = tuple(c for c in self._COMMANDS if c in commands)
+        self.timeout = timeout
+        self.quiet = quiet
+        self._workers = []
+
+    def __repr__(self):
+        return '<%s(%d servers,%d processes)>' % (self.__class__.__name__,
+                                                 len(self.servers),
+                                                 self.processes)
+
+    @property
+    def shards(self):
+        '''
+        List of server lists, one per worker process.
+        '''
+        return [self.servers[i::self.processes] for i in range(self.processes)]
+
+    def start(self,cycles=None):
+        '''
+        :param: cycles - integer polls per worker, None polls until stop()
+
+        Starts the worker processes.
+        '''
+        context = get_context()
+        for shard in self.shards:
+            if not shard:
+                continue
+            parent,child = Pipe(duplex=False)
+            process = context.Process(target=_worker,
+                                      args=(child,shard,self.commands,
+                                            self.interval,self.timeout,
+                                            self.quiet,cycles),
+                                      daemon=True)
+            process.start()
+            child.close()
+            self._workers.append((process,parent))
+
+    def results(self,timeout=None):
+        '''
+        :param: timeout - float seconds to wait for each result, None
+                          waits as long as workers are running
+        :return: generator of CollectedServer, ends when every worker has
+                 finished or nothing arrived within timeout
+        '''
+        conns = [conn for _,conn in self._workers]
+        while conns:
+            ready = wait(conns,timeout)
+            if not ready:
+                return
+            for conn in ready:
+                try:
+                    data = conn.recv_bytes()
+                except (EOFError,OSError):
+                    conns.remove(conn)
+                    continue
+                yield decode(data)
+
+    def collect(self):
+        '''
+        :return: list of CollectedServer, one poll of every server
+
+        Runs a single polling cycle in the worker pool and waits for it.
+        '''
+        self.start(cycles=1)
+        try:
+            return list(self.results())
+        finally:
+            self.stop()
+
+    def stop(self):
+        '''
+        Stops the worker processes.
+        '''
+        for process,conn in self._workers:
+            conn.close()
+        for process,_ in self._workers:
+            process.join(max(1.0,self.timeout * 2))
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._workers = []
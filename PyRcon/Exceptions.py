@@ -14,4 +14,15 @@ class PlayerNotFound(Exception):
 class ServerPasswordNotSet(Exception):
     pass
 
+class FileNotFound(Exception):
+    pass
+
+class MapLoadTimeout(Exception):
+    pass
+
+class RolloutAborted(Exception):
+    pass
+
+class CircuitOpenError(NoResponseError):
+    pass
 
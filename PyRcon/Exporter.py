@@ -0,0 +1,355 @@
+'''
+Prometheus-style metrics exporter for a fleet of CoD4 servers.
+
+A FleetExporter polls its consoles in the background, at most
+'concurrency' servers at a time, and keeps the latest players,
+mapname, gametype and serverinfo of each.  A poll costs two commands,
+'status' and 'serverinfo'; the map and gametype are read from the
+serverinfo reply.  The dvardump used to split serverinfo's run-on
+keys is only refreshed every 'dvar_interval' seconds.  Scrapes of the
+HTTP endpoint are answered from those snapshots and never cause rcon
+traffic of their own.
+
+Players are exported as per-server aggregates, not one series per
+player, so the number of series does not grow with every name seen.
+The exporter also publishes the client side latency, request and
+timeout counters from the consoles' latency profiles.
+
+  python -m PyRcon.Exporter -p secret -S fleet.txt --listen 127.0.0.1:9128
+'''
+
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+from time import monotonic, time
+
+from .CoD4 import RemoteConsole
+from .Exceptions import NoResponseError, UsageError, ServerPasswordNotSet
+from .LatencyProfile import LatencyProfile
+from .Shell import parse_address, read_servers
+
+
+def _escape(value):
+    return str(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+
+def _labels(**labels):
+    return '{%s}' % ','.join('%s="%s"' % (k,_escape(v))
+                             for k,v in sorted(labels.items()))
+
+
+class ServerSnapshot(object):
+    '''
+    The most recent values polled from one server.
+    '''
+    __slots__ = ('players','mapname','gametype','serverinfo',
+                 'up','timestamp','duration','error')
+
+    def __init__(self):
+        self.players = {}
+        self.mapname = None
+        self.gametype = None
+        self.serverinfo = {}
+        self.up = False
+        self.timestamp = 0.0
+        self.duration = 0.0
+        self.error = None
+
+
+class FleetExporter(object):
+    '''
+    Polls a set of RemoteConsoles and serves their state as metrics.
+    '''
+    _ERRORS = (NoResponseError,UsageError,ServerPasswordNotSet,
+               ValueError,IndexError,KeyError,OSError)
+
+    def __init__(self,consoles,interval=30.0,concurrency=8,
+                 listen=('127.0.0.1',9128),dvar_interval=3600.0):
+        '''
+        :param: consoles      - list of RemoteConsoles to poll
+        :param: interval      - float seconds between polling cycles
+        :param: concurrency   - integer maximum servers polled at once
+        :param: listen        - tuple (host,port) for the HTTP endpoint
+        :param: dvar_interval - float seconds a server's dvardump is
+                                reused for splitting serverinfo keys
+        '''
+        self.consoles = list(consoles)
+        self.interval = interval
+        self.concurrency = concurrency
+        self.listen = listen
+        self.dvar_interval = dvar_interval
+        self._lock = Lock()
+        self._snapshots = {}
+        self._dvars = {}
+        self._stop = Event()
+        self._threads = []
+        self._httpd = None
+
+    def __repr__(self):
+        return '<%s(%d servers,%s,%s)>' % (self.__class__.__name__,
+                                           len(self.consoles),
+                                           self.interval,
+                                           self.concurrency)
+
+    def _name(self,console):
+        return '%s:%s' % (console.host,console.port)
+
+    def _serverinfo(self,console):
+        '''
+        serverinfo split with a dvardump fetched at most once every
+        dvar_interval seconds per server.
+        '''
+        name = self._name(console)
+        with self._lock:
+            expires,dvars = self._dvars.get(name,(0.0,None))
+        if dvars is None or monotonic() >= expires:
+            dvars = console.dvardump()
+            with self._lock:
+                self._dvars[name] = (monotonic() + self.dvar_interval,dvars)
+        return console._parse_info(console._list('serverinfo'),dvars)
+
+    def poll_one(self,console):
+        '''
+        :param: console - RemoteConsole
+        :return: ServerSnapshot
+
+        Queries one server and stores the result.  A server that fails
+        to answer keeps its previous values but is marked down.
+        '''
+        name = self._name(console)
+        with self._lock:
+            previous = self._snapshots.get(name)
+        snap = ServerSnapshot()
+        if previous is not None:
+            for attr in ServerSnapshot.__slots__:
+                setattr(snap,attr,getattr(previous,attr))
+
+        start = monotonic()
+        try:
+            snap.players = console.players
+            snap.serverinfo = self._serverinfo(console)
+            snap.mapname = snap.serverinfo.get('mapname')
+            snap.gametype = snap.serverinfo.get('g_gametype')
+            snap.up = True
+            snap.error = None
+        except self._ERRORS as error:
+            snap.up = False
+            snap.error = error.__class__.__name__
+        snap.duration = monotonic() - start
+        snap.timestamp = time()
+
+        with self._lock:
+            self._snapshots[name] = snap
+        return snap
+
+    def poll(self):
+        '''
+        Runs one polling cycle over every console.
+        '''
+        with ThreadPoolExecutor(max_workers=max(1,self.concurrency)) as pool:
+            list(pool.map(self.poll_one,self.consoles))
+
+    def snapshots(self):
+        '''
+        :return: dictionary of 'host:port' -> ServerSnapshot
+        '''
+        with self._lock:
+            return dict(self._snapshots)
+
+    def render(self):
+        '''
+        :return: string metrics in the Prometheus text exposition format
+        '''
+        out = []
+        def family(name,kind,text):
+            out.append('# HELP %s %s' % (name,text))
+            out.append('# TYPE %s %s' % (name,kind))
+
+        snaps = sorted(self.snapshots().items())
+
+        family('pyrcon_up','gauge','1 if the last poll of the server succeeded.')
+        for server,snap in snaps:
+            out.append('pyrcon_up%s %d' % (_labels(server=server),snap.up))
+
+        family('pyrcon_players','gauge','Players connected.')
+        for server,snap in snaps:
+            out.append('pyrcon_players%s %d' % (_labels(server=server),
+                                                len(snap.players)))
+
+        columns = {}
+        for server,snap in snaps:
+            for field in ('ping','score'):
+                values = []
+                for row in snap.players.values():
+                    try:
+                        values.append(int(row[field]))
+                    except (KeyError,ValueError):
+                        continue
+                columns[(server,field)] = values
+
+        for name,field,text,reduce in (
+                ('pyrcon_player_ping_mean','ping','Mean ping of connected players.',
+                 lambda v:sum(v) / len(v)),
+                ('pyrcon_player_ping_max','ping','Highest ping of connected players.',max),
+                ('pyrcon_player_score_total','score','Sum of connected players\' scores.',sum),
+                ('pyrcon_player_score_max','score','Highest score of connected players.',max)):
+            family(name,'gauge',text)
+            for server,_ in snaps:
+                values = columns[(server,field)]
+                if values:
+                    out.append('%s%s %g' % (name,_labels(server=server),reduce(values)))
+
+        family('pyrcon_map_info','gauge','Current map and gametype.')
+        for server,snap in snaps:
+            if snap.mapname is None:
+                continue
+            out.append('pyrcon_map_info%s 1' % _labels(server=server,
+                                                       map=snap.mapname,
+                                                       gametype=snap.gametype))
+
+        family('pyrcon_serverinfo','gauge','serverinfo key/value pairs.')
+        for server,snap in snaps:
+            for key,value in sorted(snap.serverinfo.items()):
+                out.append('pyrcon_serverinfo%s 1' % _labels(server=server,
+                                                             key=key,
+                                                             value=value))
+
+        family('pyrcon_poll_duration_seconds','gauge','Time taken by the last poll.')
+        for server,snap in snaps:
+            out.append('pyrcon_poll_duration_seconds%s %.6f' % (_labels(server=server),
+                                                               snap.duration))
+
+        family('pyrcon_poll_timestamp_seconds','gauge','Unix time of the last poll.')
+        for server,snap in snaps:
+            out.append('pyrcon_poll_timestamp_seconds%s %.3f' % (_labels(server=server),
+                                                                snap.timestamp))
+
+        profiles = {}
+        for console in self.consoles:
+            profiles.setdefault(id(console.profile),console.profile)
+        estimates = []
+        for profile in profiles.values():
+            estimates.extend(profile.estimates())
+        estimates.sort(key=lambda item:(item[0][0],item[0][1] or ''))
+        estimates = [(_labels(server=server,verb=verb or '*'),est)
+                     for (server,verb),est in estimates]
+
+        family('pyrcon_client_requests_total','counter','rcon requests sent.')
+        for labels,est in estimates:
+            out.append('pyrcon_client_requests_total%s %d' % (labels,est.sent))
+
+        family('pyrcon_client_timeouts_total','counter','rcon requests that got no reply.')
+        for labels,est in estimates:
+            out.append('pyrcon_client_timeouts_total%s %d' % (labels,est.timeouts))
+
+        family('pyrcon_client_loss_ratio','gauge','Fraction of rcon requests unanswered.')
+        for labels,est in estimates:
+            out.append('pyrcon_client_loss_ratio%s %.6f' % (labels,est.loss))
+
+        family('pyrcon_client_rtt_seconds','gauge','Smoothed time to the first reply chunk.')
+        for labels,est in estimates:
+            if est.samples:
+                out.append('pyrcon_client_rtt_seconds%s %.6f' % (labels,est.srtt))
+
+        out.append('')
+        return '\n'.join(out)
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = monotonic()
+            self.poll()
+            self._stop.wait(max(0.0,self.interval - (monotonic() - started)))
+
+    def _handler(self):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/','/metrics'):
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type','text/plain; version=0.0.4')
+                self.send_header('Content-Length',str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self,*args):
+                pass
+
+        return Handler
+
+    def start(self):
+        '''
+        Starts the polling thread and the HTTP server.
+        '''
+        self._stop.clear()
+        self._httpd = ThreadingHTTPServer(self.listen,self._handler())
+        self.listen = self._httpd.server_address[:2]
+        self._threads = [Thread(target=self._run,daemon=True),
+                         Thread(target=self._httpd.serve_forever,daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        '''
+        Stops polling and shuts the HTTP server down.
+        '''
+        self._stop.set()
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+def main(argv=None):
+    '''
+    Entry point for 'python -m PyRcon.Exporter'.
+    '''
+    parser = argparse.ArgumentParser(prog='pyrcon-exporter',
+                                     description='CoD4 fleet metrics exporter')
+    parser.add_argument('servers',nargs='*',metavar='HOST[:PORT]')
+    parser.add_argument('-p','--password',
+                        default=os.environ.get('PYRCON_PASSWORD'))
+    parser.add_argument('-P','--port',type=int,default=28960)
+    parser.add_argument('-S','--servers-file',action='append',default=[])
+    parser.add_argument('-i','--interval',type=float,default=30.0)
+    parser.add_argument('-j','--concurrency',type=int,default=8)
+    parser.add_argument('--listen',default='127.0.0.1:9128')
+    args = parser.parse_args(argv)
+
+    servers = [parse_address(s,args.port) + (args.password,)
+               for s in args.servers]
+    for path in args.servers_file:
+        servers.extend(read_servers(path,args.password,args.port))
+    if not servers:
+        parser.error('no servers given')
+    for host,port,passwd in servers:
+        if not passwd:
+            parser.error('no rcon password for %s:%s, use -p or $PYRCON_PASSWORD'
+                         % (host,port))
+
+    profile = LatencyProfile()
+    consoles = [RemoteConsole(passwd,host,port,profile=profile)
+                for host,port,passwd in servers]
+    exporter = FleetExporter(consoles,args.interval,args.concurrency,
+                             parse_address(args.listen,9128))
+    exporter.start()
+    try:
+        Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        exporter.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+'''
+Rolling, health gated operations across a fleet of servers.
+
+Disruptive commands such as 'map', 'restart' or 'killserver' are run
+in waves: at most 'wave_size' servers are changing at any one time,
+and the next wave only starts once every server in the current one
+is healthy again.  A server is healthy when it has been seen to
+change, answers getinfo, is running the expected map and has got back
+at least 'player_recovery' of the players it had before the change.
+Restarts and rotations take effect on a later server frame, so for
+those the change is only taken as seen once the server stopped
+answering for a moment or its sv_serverid moved on; until then the
+old map's replies and players don't count.  Other actions either load
+inside the rcon command ('map') or need not change either ('execute',
+'net_restart'), so only the health checks apply to them.
+
+The rollout stops as soon as more than 'max_failures' servers have
+failed, raising RolloutAborted with the results gathered so far.
+
+  op = RollingOperation(consoles,'map',('mp_crash',),wave_size=5)
+  results = op.run()
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from time import monotonic, sleep
+
+from .Exceptions import *
+
+
+class ServerResult(object):
+    '''
+    Outcome of a rolling operation on one server.
+    '''
+    __slots__ = ('console','ok','error','elapsed','wave',
+                 'players_before','players_after')
+
+    def __init__(self,console,wave):
+        self.console = console
+        self.wave = wave
+        self.ok = False
+        self.error = None
+        self.elapsed = 0.0
+        self.players_before = 0
+        self.players_after = 0
+
+    def __repr__(self):
+        return '<%s(%s:%s,ok=%s,error=%r,%.2fs)>' % (self.__class__.__name__,
+                                                   self.console.host,
+                                                   self.console.port,
+                                                   self.ok,
+                                                   self.error,
+                                                   self.elapsed)
+
+
+class RollingOperation(object):
+    '''
+    Runs one console method across many consoles in health gated waves.
+    '''
+    _ACTIONS = ('map','change_map','restart','next_map','net_restart',
+                'execute','killserver')
+    _WAITING = ('map','restart','next_map')
+    _CHANGING = ('restart','next_map')
+    _ERRORS = (NoResponseError,UsageError,ServerPasswordNotSet,FileNotFound,
+               MapLoadTimeout,ValueError,KeyError,OSError)
+
+    def __init__(self,consoles,action,args=(),wave_size=4,max_failures=0,
+                 ready_timeout=120.0,player_recovery=0.5,player_timeout=60.0,
+                 pause=0.0,expected_map=None,on_wave=None,require_change=True):
+        '''
+        :param: consoles        - list of RemoteConsoles
+        :param: action          - string name of a disruptive console method
+        :param: args            - tuple of arguments for the method
+        :param: wave_size       - integer servers changed at once
+        :param: max_failures    - integer failures tolerated before aborting
+        :param: ready_timeout   - float seconds for a server to come back
+        :param: player_recovery - float fraction of players that must return
+        :param: player_timeout  - float seconds allowed for players to return
+        :param: pause           - float seconds between waves
+        :param: expected_map    - string map servers must be running after
+                                  the action, by default the map named in
+                                  args, the next map in the rotation for
+                                  next_map, or the map they were running
+                                  before
+        :param: on_wave         - callable(wave_number,results) run per wave
+        :param: require_change  - bool, after a restart or next_map wait
+                                  for the server to be seen to change
+                                  before checking its health
+        '''
+        if action not in self._ACTIONS:
+            raise ValueError('%s not one of %s' % (action,self._ACTIONS))
+        self.consoles = list(consoles)
+        self.action = action
+        self.args = tuple(args)
+        self.wave_size = max(1,wave_size)
+        self.max_failures = max_failures
+        self.ready_timeout = ready_timeout
+        self.player_recovery = player_recovery
+        self.player_timeout = player_timeout
+        self.pause = pause
+        self.expected_map = expected_map
+        self.on_wave = on_wave
+        self.require_change = require_change
+
+    def __repr__(self):
+        return '<%s(%s%s,%d servers,wave_size=%d)>' % (self.__class__.__name__,
+                                                     self.action,
+                                                     self.args,
+                                                     len(self.consoles),
+                                                     self.wave_size)
+
+    @property
+    def waves(self):
+        '''
+        List of lists of consoles, one list per wave.
+        '''
+        n = self.wave_size
+        return [self.consoles[i:i+n] for i in range(0,len(self.consoles),n)]
+
+    def _player_count(self,console,info=None):
+        if info is None:
+            info = console.getinfo()
+        try:
+            return int(info['clients'])
+        except (KeyError,ValueError):
+            return len(console.players)
+
+    def _expected_map(self,console,before):
+        if self.expected_map is not None:
+            return self.expected_map
+        if self.action in ('map','change_map'):
+            return self.args[0]
+        if self.action == 'next_map':
+            return console._next_rotation_map()
+        return before
+
+    def _apply(self,console):
+        '''
+        Runs the action on one console and waits for it to be healthy.
+        '''
+        start = monotonic()
+        result = ServerResult(console,None)
+        try:
+            info = console.getinfo()
+            result.players_before = self._player_count(console,info)
+            expected = self._expected_map(console,info.get('mapname'))
+            # restarts and rotations are acted on later; map loads inside
+            # the rcon command, net_restart and execute need not change
+            # sv_serverid at all
+            changed = None
+            if self.require_change and self.action in self._CHANGING:
+                changed = console._changed()
+
+            method = getattr(console,self.action)
+            if self.action in self._WAITING:
+                method(*self.args,wait=True,timeout=self.ready_timeout)
+            elif self.action == 'change_map':
+                method(*self.args,timeout=self.ready_timeout)
+            else:
+                method(*self.args)
+
+            if self.action == 'killserver':
+                result.ok = True
+                return result
+
+            console.wait_until_ready(expected,self.ready_timeout,start=start,
+                                     changed=changed)
+
+            wanted = int(ceil(result.players_before * self.player_recovery))
+            deadline = monotonic() + self.player_timeout
+            interval = 0.5
+            while True:
+                result.players_after = self._player_count(console)
+                if result.players_after >= wanted:
+                    break
+                if monotonic() >= deadline:
+                    raise RolloutAborted('players did not return',
+                                         result.players_after,wanted)
+                sleep(interval)
+                interval = min(interval * 2,5.0)
+            result.ok = True
+        except self._ERRORS + (RolloutAborted,) as error:
+            result.error = error
+        finally:
+            result.elapsed = monotonic() - start
+        return result
+
+    def run(self):
+        '''
+        :return: list of ServerResults in console order
+
+        Raises RolloutAborted(message,results) once more than
+        max_failures servers have failed, after the wave in flight
+        has finished.
+        '''
+        results = []
+        failures = 0
+        with ThreadPoolExecutor(max_workers=self.wave_size) as pool:
+            for number,wave in enumerate(self.waves):
+                if number and self.pause:
+                    sleep(self.pause)
+                wave_results = list(pool.map(self._apply,wave))
+                for result in wave_results:
+                    result.wave = number
+                results.extend(wave_results)
+                if self.on_wave is not None:
+                    self.on_wave(number,wave_results)
+                failures += len([r for r in wave_results if not r.ok])
+                if failures > self.max_failures:
+                    raise RolloutAborted('%d servers failed in wave %d' % (failures,number),
+                                         results)
+        return results
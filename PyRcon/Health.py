@@ -0,0 +1,266 @@
+'''
+Server health probing and per-server circuit breakers.
+
+Without help, every command sent to a dead server blocks for its full
+timeout * (retries+1) before NoResponseError is raised.  A
+CircuitBreaker assigned to a console's 'breaker' attribute counts
+consecutive unanswered commands and, past a threshold, opens: further
+commands fail at once with CircuitOpenError (a NoResponseError) until
+reset_timeout has passed, when one trial command is let through
+(half-open).  Success closes the breaker, failure opens it again.
+
+A HealthProber pings its consoles in the background with the cheap,
+password-less getinfo query and keeps RTT and loss scores for each.
+Lost pings count against a server's breaker, so dead servers are
+failed fast before any caller has to wait on them, and a ping that is
+answered half-opens an open breaker without waiting for its reset
+timeout.  Ping timings also land in each console's latency profile,
+where they stretch the timeouts used for commands not yet profiled.
+Probes use the console's own socket; the console serializes them with
+its other commands, so they wait for a command in flight to finish.
+
+  prober = HealthProber(consoles)
+  prober.start()
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
+from time import monotonic
+
+from .Exceptions import NoResponseError
+
+
+class CircuitBreaker(object):
+    '''
+    Closed / open / half-open breaker for one server.
+    '''
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self,threshold=3,reset_timeout=30.0):
+        '''
+        :param: threshold     - integer consecutive failures that open it
+        :param: reset_timeout - float seconds open before a trial request
+        '''
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened = 0.0
+        self._trial = None
+        self._lock = Lock()
+
+    def __repr__(self):
+        return '<%s(%s,%d failures)>' % (self.__class__.__name__,
+                                         self.state,
+                                         self.failures)
+
+    def allow(self):
+        '''
+        :return: bool, True if a request may be sent now
+
+        While half-open a single trial request is allowed; should its
+        outcome never be reported another is allowed after
+        reset_timeout.
+        '''
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = monotonic()
+            if self.state == self.OPEN:
+                if now - self._opened < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._trial = None
+            if self._trial is not None and now - self._trial < self.reset_timeout:
+                return False
+            self._trial = now
+            return True
+
+    def success(self):
+        '''
+        Records an answered request, closing the breaker.
+        '''
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial = None
+
+    def failure(self):
+        '''
+        Records an unanswered request.
+        '''
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                self.state = self.OPEN
+                self._opened = monotonic()
+            self._trial = None
+
+    def half_open(self):
+        '''
+        Lets the next request through as a trial if the breaker is open.
+        '''
+        with self._lock:
+            if self.state == self.OPEN:
+                self.state = self.HALF_OPEN
+                self._trial = None
+
+
+class HealthScore(object):
+    '''
+    Smoothed probe results for one server.
+    '''
+    __slots__ = ('rtt','loss','probes','failures','last_seen')
+
+    _ALPHA = 0.2
+
+    def __init__(self):
+        self.rtt = None
+        self.loss = 0.0
+        self.probes = 0
+        self.failures = 0
+        self.last_seen = None
+
+    def __repr__(self):
+        rtt = -1.0 if self.rtt is None else self.rtt
+        return '<%s(rtt=%.4f,loss=%.2f,failures=%d)>' % (self.__class__.__name__,
+                                                         rtt,
+                                                         self.loss,
+                                                         self.failures)
+
+    def update(self,rtt):
+        '''
+        :param: rtt - float seconds the probe took, None if it was lost
+        '''
+        self.probes += 1
+        if rtt is None:
+            self.failures += 1
+            self.loss += self._ALPHA * (1.0 - self.loss)
+            return
+        self.failures = 0
+        self.loss += self._ALPHA * (0.0 - self.loss)
+        self.last_seen = monotonic()
+        if self.rtt is None:
+            self.rtt = rtt
+        else:
+            self.rtt += self._ALPHA * (rtt - self.rtt)
+
+    @property
+    def healthy(self):
+        '''
+        True if the last probe was answered.
+        '''
+        return self.probes > 0 and self.failures == 0
+
+
+class HealthProber(object):
+    '''
+    Background getinfo pings scoring RTT and loss for each console.
+    '''
+
+    def __init__(self,consoles,interval=5.0,timeout=0.5,concurrency=32,
+                 threshold=3,reset_timeout=30.0):
+        '''
+        :param: consoles      - list of RemoteConsoles
+        :param: interval      - float seconds between probe cycles
+        :param: timeout       - float seconds to wait for each ping
+        :param: concurrency   - integer servers pinged at once
+        :param: threshold     - integer, see CircuitBreaker
+        :param: reset_timeout - float, see CircuitBreaker
+
+        Consoles without a breaker are given one.
+        '''
+        self.consoles = list(consoles)
+        self.interval = interval
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self._scores = {}
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+        for console in self.consoles:
+            if console.breaker is None:
+                console.breaker = CircuitBreaker(threshold,reset_timeout)
+
+    def __repr__(self):
+        return '<%s(%d servers,%s)>' % (self.__class__.__name__,
+                                        len(self.consoles),
+                                        self.interval)
+
+    def _name(self,console):
+        return '%s:%s' % (console.host,console.port)
+
+    def probe(self,console):
+        '''
+        :param: console - RemoteConsole
+        :return: HealthScore for the console's server
+        '''
+        start = monotonic()
+        try:
+            console.getinfo(timeout=self.timeout,retries=0)
+            rtt = monotonic() - start
+        except (NoResponseError,ValueError,OSError):
+            rtt = None
+
+        name = self._name(console)
+        with self._lock:
+            score = self._scores.get(name)
+            if score is None:
+                score = self._scores.setdefault(name,HealthScore())
+            score.update(rtt)
+
+        breaker = console.breaker
+        if breaker is not None:
+            if rtt is None:
+                breaker.failure()
+            elif breaker.state == breaker.OPEN:
+                breaker.half_open()
+        return score
+
+    def probe_all(self):
+        '''
+        Runs one probe cycle over every console.
+        '''
+        with ThreadPoolExecutor(max_workers=max(1,self.concurrency)) as pool:
+            list(pool.map(self.probe,self.consoles))
+
+    def scores(self):
+        '''
+        :return: dictionary of 'host:port' -> HealthScore
+        '''
+        with self._lock:
+            return dict(self._scores)
+
+    def healthy(self):
+        '''
+        :return: list of consoles whose last probe was answered
+        '''
+        scores = self.scores()
+        return [c for c in self.consoles
+                if scores.get(self._name(c)) is not None
+                and scores[self._name(c)].healthy]
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = monotonic()
+            self.probe_all()
+            self._stop.wait(max(0.0,self.interval - (monotonic() - started)))
+
+    def start(self):
+        '''
+        Starts probing in a background thread.
+        '''
+        self._stop.clear()
+        self._thread = Thread(target=self._run,daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stops the probing thread.
+        '''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
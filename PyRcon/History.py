@@ -0,0 +1,213 @@
+'''
+Bounded history of polled 'status' samples.
+
+A StatusHistory keeps player rows (time, player, ping, score) and
+per-sample player counts in fixed size, array backed ring buffers.
+Once full, the oldest rows are overwritten, so the memory used stays
+the same however long the process runs.  Player names are interned
+into a table that is bounded by the same capacity and forgets players
+whose rows have all been overwritten.
+
+Queries look back 'window' seconds from the newest sample.
+
+  history = StatusHistory(capacity=50000,window=600)
+  console = RemoteConsole('secret','game1',history=history)
+  console.players
+  history.average_ping()
+'''
+
+from array import array
+from threading import Lock
+from time import time
+
+
+class StatusHistory(object):
+    '''
+    Fixed size ring buffers of status samples with windowed queries.
+    '''
+    _NO_PING = -1
+
+    def __init__(self,capacity=32768,samples=4096,window=600.0):
+        '''
+        :param: capacity - integer player rows kept
+        :param: samples  - integer status samples kept for player_count()
+        :param: window   - float default look-back of queries in seconds
+        '''
+        self.capacity = capacity
+        self.samples = samples
+        self.window = window
+        self._lock = Lock()
+
+        self._when = array('d',[0.0]) * capacity
+        self._who = array('l',[0]) * capacity
+        self._ping = array('l',[0]) * capacity
+        self._score = array('l',[0]) * capacity
+        self._head = 0
+        self._count = 0
+
+        self._sample_when = array('d',[0.0]) * samples
+        self._sample_players = array('l',[0]) * samples
+        self._sample_head = 0
+        self._sample_count = 0
+
+        self._ids = {}
+        self._names = [None] * capacity
+        self._refs = array('l',[0]) * capacity
+        self._free = list(range(capacity - 1,-1,-1))
+
+    def __repr__(self):
+        return '<%s(%d/%d rows,%d players)>' % (self.__class__.__name__,
+                                                self._count,
+                                                self.capacity,
+                                                len(self._ids))
+
+    def __len__(self):
+        return self._count
+
+    def _intern(self,name):
+        pid = self._ids.get(name)
+        if pid is None:
+            pid = self._free.pop()
+            self._ids[name] = pid
+            self._names[pid] = name
+        self._refs[pid] += 1
+        return pid
+
+    def _release(self,pid):
+        self._refs[pid] -= 1
+        if self._refs[pid] == 0:
+            del self._ids[self._names[pid]]
+            self._names[pid] = None
+            self._free.append(pid)
+
+    def record(self,players,when=None):
+        '''
+        :param: players - dictionary as returned by RemoteConsole.players
+        :param: when    - float unix time of the sample, defaults to now
+        '''
+        if when is None:
+            when = time()
+        with self._lock:
+            i = self._sample_head
+            self._sample_when[i] = when
+            self._sample_players[i] = len(players)
+            self._sample_head = (i + 1) % self.samples
+            self._sample_count = min(self._sample_count + 1,self.samples)
+
+            for name,row in players.items():
+                try:
+                    score = int(row.get('score',0))
+                except ValueError:
+                    continue
+                try:
+                    ping = int(row.get('ping',self._NO_PING))
+                except ValueError:
+                    ping = self._NO_PING
+
+                i = self._head
+                if self._count == self.capacity:
+                    self._release(self._who[i])
+                else:
+                    self._count += 1
+                self._when[i] = when
+                self._who[i] = self._intern(name)
+                self._ping[i] = ping
+                self._score[i] = score
+                self._head = (i + 1) % self.capacity
+
+    def _rows(self,window):
+        '''
+        Returns (when,pid,ping,score) tuples for rows in the window,
+        oldest first.  Rows are recorded in time order, so the scan
+        walks back from the newest row and stops at the window's edge.
+        '''
+        if window is None:
+            window = self.window
+        if self._count == 0:
+            return []
+        newest = self._when[(self._head - 1) % self.capacity]
+        rows = []
+        for n in range(1,self._count + 1):
+            i = (self._head - n) % self.capacity
+            if newest - self._when[i] > window:
+                break
+            rows.append((self._when[i],self._who[i],
+                         self._ping[i],self._score[i]))
+        rows.reverse()
+        return rows
+
+    def rows(self,window=None):
+        '''
+        :param: window - float seconds to look back, default self.window
+        :return: list of (unix_time,name,ping,score) tuples, oldest
+                 first, ping -1 where none was reported
+        '''
+        with self._lock:
+            return [(when,self._names[pid],ping,score)
+                    for when,pid,ping,score in self._rows(window)]
+
+    def players(self,window=None):
+        '''
+        :param: window - float seconds to look back, default self.window
+        :return: set of player names seen in the window
+        '''
+        with self._lock:
+            return set(self._names[pid] for _,pid,_,_ in self._rows(window))
+
+    def average_ping(self,window=None):
+        '''
+        :param: window - float seconds to look back, default self.window
+        :return: dictionary of player name -> mean ping
+        '''
+        totals = {}
+        with self._lock:
+            for _,pid,ping,_ in self._rows(window):
+                if ping == self._NO_PING:
+                    continue
+                total = totals.setdefault(pid,[0,0])
+                total[0] += ping
+                total[1] += 1
+            return {self._names[pid]:t[0] / t[1] for pid,t in totals.items()}
+
+    def score_rate(self,window=None):
+        '''
+        :param: window - float seconds to look back, default self.window
+        :return: dictionary of player name -> points per minute
+
+        Only score increases count, so a score reset by a map change
+        does not produce a negative rate.  Players sampled once are
+        left out.
+        '''
+        seen = {}
+        with self._lock:
+            for when,pid,_,score in self._rows(window):
+                state = seen.get(pid)
+                if state is None:
+                    seen[pid] = [when,when,score,0]
+                    continue
+                if score > state[2]:
+                    state[3] += score - state[2]
+                state[1] = when
+                state[2] = score
+            return {self._names[pid]:60.0 * s[3] / (s[1] - s[0])
+                    for pid,s in seen.items() if s[1] > s[0]}
+
+    def player_count(self,window=None):
+        '''
+        :param: window - float seconds to look back, default self.window
+        :return: list of (unix_time,players) tuples, oldest first
+        '''
+        if window is None:
+            window = self.window
+        with self._lock:
+            if self._sample_count == 0:
+                return []
+            newest = self._sample_when[(self._sample_head - 1) % self.samples]
+            start = (self._sample_head - self._sample_count) % self.samples
+            timeline = []
+            for n in range(self._sample_count):
+                i = (start + n) % self.samples
+                if newest - self._sample_when[i] <= window:
+                    timeline.append((self._sample_when[i],
+                                     self._sample_players[i]))
+            return timeline
@@ -0,0 +1,266 @@
+'''
+Running latency profiles for remote console servers.
+
+The Quake-style protocol has no end-of-message marker, so send()
+decides a reply is complete when the socket has been quiet for
+'timeout' seconds, 'retries' times over.  Good values depend on the
+server and on the command: a LAN server answers 'status' in a couple
+of milliseconds while a remote one may take a quarter second to start
+replying to 'dvardump'.
+
+A LatencyProfile keeps a smoothed estimate for every (server,verb)
+pair it has seen and derives timeout/retries values from it.  The
+round trip to the first reply chunk is tracked the same way TCP
+tracks RTT (RFC 6298), and the longest silence between chunks of a
+multi-packet reply is tracked separately since that is what the
+timeout has to outlast.
+
+send() always waits out the whole budget, timeout*(retries+1), so a
+profiled verb gets a budget of its estimated round trip plus one
+server frame and twice its longest gap, with _MIN_BUDGET as a lower
+bound.  A fast server therefore gets shorter budgets than the
+hard-coded defaults and a slow one longer.  Verbs with too few samples
+keep the caller's default, stretched to the server's round trip plus a
+frame if that is longer.
+'''
+
+import json
+from math import ceil
+from threading import RLock
+
+
+class LatencyEstimate(object):
+    '''
+    Smoothed latency figures for one (server,verb) pair.
+    '''
+    __slots__ = ('srtt','rttvar','gap','samples','sent','timeouts','backoff')
+
+    _ALPHA = 0.125
+    _BETA = 0.25
+
+    def __init__(self,srtt=0.0,rttvar=0.0,gap=0.0,samples=0):
+        self.srtt = srtt
+        self.rttvar = rttvar
+        self.gap = gap
+        self.samples = samples
+        self.sent = 0
+        self.timeouts = 0
+        self.backoff = 1
+
+    def __repr__(self):
+        return '<%s(srtt=%.4f,rttvar=%.4f,gap=%.4f,samples=%d)>' % (
+            self.__class__.__name__,
+            self.srtt,self.rttvar,self.gap,self.samples)
+
+    @property
+    def rto(self):
+        '''
+        Seconds to wait for the first chunk of a reply.
+        '''
+        return (self.srtt + 4 * self.rttvar) * self.backoff
+
+    @property
+    def loss(self):
+        '''
+        Fraction of requests that went unanswered.
+        '''
+        if self.sent == 0:
+            return 0.0
+        return self.timeouts / self.sent
+
+    def update(self,first,gap):
+        '''
+        :param: first - float seconds until the first reply chunk
+        :param: gap   - float longest silence between reply chunks
+        '''
+        if self.samples == 0:
+            self.srtt = first
+            self.rttvar = first / 2
+            self.gap = gap
+        else:
+            self.rttvar += self._BETA * (abs(self.srtt - first) - self.rttvar)
+            self.srtt += self._ALPHA * (first - self.srtt)
+            # gaps rise immediately and decay slowly, a truncated
+            # reply costs more than a slightly longer wait
+            if gap > self.gap:
+                self.gap = gap
+            else:
+                self.gap += self._ALPHA * (gap - self.gap)
+        self.samples += 1
+        self.backoff = 1
+
+    def missed(self):
+        '''
+        Note an unanswered request, backing off the estimate
+        like TCP does on a retransmission timeout.
+        '''
+        self.timeouts += 1
+        self.backoff = min(self.backoff * 2,8)
+
+
+class LatencyProfile(object):
+    '''
+    Latency estimates keyed by server address and command verb.
+
+    A single profile may be shared by any number of consoles, each
+    server is tracked under its own address.  Every sample is also
+    folded into a per-server estimate (verb None) which is used to
+    stretch the caller's defaults for verbs that have not been seen
+    often enough to be trusted on their own.
+
+    If 'path' is given the profile is loaded from it when created
+    and written back by save().
+    '''
+    _MIN_SAMPLES = 3
+    _MIN_TIMEOUT = 0.02
+    _MAX_TIMEOUT = 2.0
+    _MAX_RETRIES = 50
+    _SERVER_FRAME = 0.05
+    _MIN_BUDGET = 0.06
+    _VERSION = 1
+
+    def __init__(self,path=None):
+        '''
+        :param: path - optional string filename used by load() and save()
+        '''
+        self.path = path
+        self._lock = RLock()
+        self._estimates = {}
+        if path is not None:
+            try:
+                self.load()
+            except (IOError,OSError,ValueError):
+                pass
+
+    def __repr__(self):
+        return '<%s(%s)>' % (self.__class__.__name__,self.path)
+
+    def __len__(self):
+        return len(self._estimates)
+
+    def _key(self,address):
+        return '%s:%s' % tuple(address[:2])
+
+    def estimate(self,address,verb=None):
+        '''
+        :param: address - tuple (host,port)
+        :param: verb    - string command verb or None for the server
+        :return: LatencyEstimate
+
+        Returns the estimate for address and verb, creating it if needed.
+        '''
+        key = (self._key(address),verb)
+        with self._lock:
+            try:
+                return self._estimates[key]
+            except KeyError:
+                est = self._estimates.setdefault(key,LatencyEstimate())
+        return est
+
+    def estimates(self):
+        '''
+        :return: list of ((address_string,verb),LatencyEstimate) tuples
+        '''
+        with self._lock:
+            return list(self._estimates.items())
+
+    def sent(self,address,verb):
+        '''
+        :param: address - tuple (host,port)
+        :param: verb    - string command verb
+
+        Counts a request sent to address.
+        '''
+        with self._lock:
+            self.estimate(address,verb).sent += 1
+            self.estimate(address).sent += 1
+
+    def record(self,address,verb,first,gap=0.0):
+        '''
+        :param: address - tuple (host,port)
+        :param: verb    - string command verb
+        :param: first   - float seconds until the first reply chunk
+        :param: gap     - float longest silence between reply chunks
+        '''
+        with self._lock:
+            self.estimate(address,verb).update(first,gap)
+            self.estimate(address).update(first,0.0)
+
+    def record_timeout(self,address,verb):
+        '''
+        :param: address - tuple (host,port)
+        :param: verb    - string command verb
+
+        Counts a request that received no reply.
+        '''
+        with self._lock:
+            self.estimate(address,verb).missed()
+            self.estimate(address).missed()
+
+    def timeout_for(self,address,verb,default):
+        '''
+        :param: address - tuple (host,port)
+        :param: verb    - string command verb
+        :param: default - tuple (timeout,retries) to use if unprofiled
+        :return: tuple (timeout,retries)
+
+        The timeout is long enough to outlast the silences seen between
+        chunks of a reply, retries are added until timeout*(retries+1)
+        covers the time it takes the first chunk to arrive, one server
+        frame and twice the longest gap.  Verbs not yet profiled keep
+        the default, which the server estimate can only lengthen.
+        '''
+        timeout,retries = default
+        with self._lock:
+            est = self._estimates.get((self._key(address),verb))
+            if est is None or est.samples < self._MIN_SAMPLES:
+                est = self._estimates.get((self._key(address),None))
+                if est is None or est.samples < self._MIN_SAMPLES:
+                    return timeout,retries
+                budget = max(timeout * (retries + 1),
+                             est.rto + self._SERVER_FRAME)
+            else:
+                timeout = max(2 * est.gap,self._MIN_TIMEOUT)
+                timeout = min(timeout,self._MAX_TIMEOUT)
+                retries = 1
+                budget = max(est.rto + self._SERVER_FRAME + 2 * est.gap,
+                             self._MIN_BUDGET)
+
+        wanted = int(ceil(budget / timeout - 1e-9)) - 1
+        if wanted > self._MAX_RETRIES:
+            timeout = min(budget / (self._MAX_RETRIES + 1),self._MAX_TIMEOUT)
+            wanted = self._MAX_RETRIES
+        return timeout,max(retries,wanted)
+
+    def load(self,path=None):
+        '''
+        :param: path - optional string filename, defaults to self.path
+
+        Merges estimates previously written by save() into this profile.
+        '''
+        with open(path or self.path) as fp:
+            data = json.load(fp)
+        if data.get('version') != self._VERSION:
+            raise ValueError('unsupported profile version %s' % (data.get('version')))
+        with self._lock:
+            for address,verbs in data['servers'].items():
+                for verb,fields in verbs.items():
+                    key = (address,verb or None)
+                    self._estimates[key] = LatencyEstimate(*fields)
+
+    def save(self,path=None):
+        '''
+        :param: path - optional string filename, defaults to self.path
+
+        Writes the smoothed estimates as JSON.  Request and timeout
+        counters are not persisted.
+        '''
+        servers = {}
+        with self._lock:
+            for (address,verb),est in self._estimates.items():
+                if est.samples == 0:
+                    continue
+                servers.setdefault(address,{})[verb or ''] = [
+                    est.srtt,est.rttvar,est.gap,est.samples]
+        with open(path or self.path,'w') as fp:
+            json.dump({'version':self._VERSION,'servers':servers},fp)
@@ -0,0 +1,523 @@
+'''
+Rcon load testing.
+
+A LoadTester drives one server with a weighted mix of 'status',
+'dvardump', 'set' and 'say' commands at a fixed request rate, spread
+over 'concurrency' consoles that each own a socket and wait for one
+reply at a time.  Requests are scheduled open loop, at start + n/rate,
+so a slow server shows up as latency and drops rather than as a lower
+offered rate.  A request that gets no reply within the timeout counts
+as dropped; replies that arrive after that are counted as late and
+discarded.
+
+flood_threshold() repeats the run at rising rates until the drop rate
+passes a limit.  The result is the rate at which the server's rcon
+flood protection begins to drop requests, which bounds how often a
+host class can safely be polled.
+
+A StandInServer answers the same commands locally with a token bucket
+per client address standing in for the flood protection, so the
+tester can be tried without a game server:
+
+  python -m PyRcon.LoadTest --stand-in --ramp
+  python -m PyRcon.LoadTest -p secret game1:28960 --rate 20 --duration 30
+
+Only point the tester at servers you run: 'set' and 'say' commands
+change dvars and print to every player.
+'''
+
+import argparse
+import os
+import random
+import sys
+from threading import Event, Lock, Thread
+from socket import socket, AF_INET, SOCK_DGRAM
+from select import select
+from time import monotonic, sleep
+
+from .CoD4 import RemoteConsole
+from .Shell import parse_address
+
+
+_COMMANDS = {
+    'status':'status',
+    'dvardump':'dvardump',
+    'set':'set pyrcon_loadtest %d',
+    'say':'say PyRcon load test %d',
+}
+
+_DEFAULT_MIX = {'status':4,'dvardump':1,'set':1,'say':1}
+
+
+def parse_mix(text):
+    '''
+    :param: text - string 'status=4,dvardump=1,...'
+    :return: dictionary of command -> integer weight
+    '''
+    mix = {}
+    for item in text.split(','):
+        name,_,weight = item.strip().partition('=')
+        if name not in _COMMANDS:
+            raise ValueError('%s not one of %s' % (name,sorted(_COMMANDS)))
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def _percentile(ordered,p):
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * p / 100.0
+    low = int(position)
+    high = min(low + 1,len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+class LoadResult(object):
+    '''
+    Counters and reply latencies of one load run.
+    '''
+    __slots__ = ('rate','duration','concurrency','sent','answered',
+                 'late','latencies','verbs')
+
+    def __init__(self,rate,duration,concurrency):
+        self.rate = rate
+        self.duration = duration
+        self.concurrency = concurrency
+        self.sent = 0
+        self.answered = 0
+        self.late = 0
+        self.latencies = []
+        self.verbs = {}
+
+    def __repr__(self):
+        return '<%s(rate=%.1f,throughput=%.1f,drop_rate=%.3f)>' % (
+            self.__class__.__name__,self.rate,self.throughput,self.drop_rate)
+
+    @property
+    def dropped(self):
+        '''
+        Number of requests that got no reply within the timeout.
+        '''
+        return self.sent - self.answered
+
+    @property
+    def drop_rate(self):
+        '''
+        Fraction of requests dropped, 0.0 if none were sent.
+        '''
+        return self.dropped / self.sent if self.sent else 0.0
+
+    @property
+    def offered(self):
+        '''
+        Requests sent per second over the run.  Below rate when every
+        console was still busy with an earlier request, in which case
+        concurrency, not the server, limited the run.
+        '''
+        return self.sent / self.duration if self.duration else 0.0
+
+    @property
+    def throughput(self):
+        '''
+        Answered requests per second over the run.
+        '''
+        return self.answered / self.duration if self.duration else 0.0
+
+    def percentiles(self,percentiles=(50,90,99)):
+        '''
+        :param: percentiles - sequence of floats between 0 and 100
+        :return: dictionary of percentile -> seconds to first reply
+                 datagram, None if nothing was answered
+        '''
+        ordered = sorted(self.latencies)
+        return {p:_percentile(ordered,p) for p in percentiles}
+
+    def report(self):
+        '''
+        :return: string summary, one line
+        '''
+        latency = ' '.join('p%s=%s' % (p,'-' if v is None else '%.1fms' % (v * 1000))
+                           for p,v in self.percentiles().items())
+        return ('rate %7.1f/s  offered %7.1f/s  throughput %7.1f/s'
+                '  dropped %5.1f%%  late %d  %s' % (self.rate,self.offered,
+                                                    self.throughput,
+                                                    100.0 * self.drop_rate,
+                                                    self.late,latency))
+
+
+class LoadTester(object):
+    '''
+    Drives a server with a controlled rate and mix of rcon commands.
+    '''
+
+    def __init__(self,password,hostname,port=28960,concurrency=8,
+                 mix=None,timeout=1.0,quiet=0.05,console_class=RemoteConsole,
+                 seed=None):
+        '''
+        :param: password      - string rcon password
+        :param: hostname      - string, name or IP address of server
+        :param: port          - integer server port
+        :param: concurrency   - integer requests outstanding at once
+        :param: mix           - dictionary of command -> weight, keys from
+                                'status', 'dvardump', 'set' and 'say'
+        :param: timeout       - float seconds to wait for a first reply
+        :param: quiet         - float seconds of silence ending a reply
+        :param: console_class - BaseRemoteConsole subclass used to talk
+                                to the server
+        :param: seed          - random seed for the command sequence
+        '''
+        mix = dict(_DEFAULT_MIX if mix is None else mix)
+        for name,weight in mix.items():
+            if name not in _COMMANDS:
+                raise ValueError('%s not one of %s' % (name,sorted(_COMMANDS)))
+            if weight < 0:
+                raise ValueError('negative weight for %s' % (name))
+        if not sum(mix.values()):
+            raise ValueError('empty command mix')
+        self.mix = mix
+        self.timeout = timeout
+        self.quiet = quiet
+        self.seed = seed
+        self.consoles = [console_class(password,hostname,port)
+                         for _ in range(max(1,concurrency))]
+
+    def __repr__(self):
+        console = self.consoles[0]
+        return '<%s(%s:%s,%d consoles,%s)>' % (self.__class__.__name__,
+                                               console.host,console.port,
+                                               len(self.consoles),self.mix)
+
+    def _request(self,console,message,result,lock):
+        '''
+        Sends one command and waits for its reply, recording the time to
+        the first reply datagram.  Replies left over from earlier,
+        dropped requests are drained first and counted as late.
+        '''
+        late = 0
+        while console._receive(0.0) is not None:
+            late += 1
+
+        verb = message.partition(' ')[0]
+        data = console.prefix + bytes('%s %s' % (console.passwd,message),'utf-8')
+        header = console.reply_header
+        start = monotonic()
+        console._transmit(data)
+        first = None
+        while True:
+            reply = console._receive(self.timeout if first is None else self.quiet)
+            if reply is None:
+                break
+            if first is None and reply.startswith(header):
+                first = monotonic() - start
+
+        with lock:
+            result.sent += 1
+            result.late += late
+            counts = result.verbs.setdefault(verb,[0,0])
+            counts[0] += 1
+            if first is not None:
+                result.answered += 1
+                result.latencies.append(first)
+                counts[1] += 1
+
+    def run(self,rate,duration=10.0):
+        '''
+        :param: rate     - float requests per second to offer
+        :param: duration - float seconds to keep offering them
+        :return: LoadResult
+        '''
+        rng = random.Random(self.seed)
+        names = sorted(self.mix)
+        weights = [self.mix[name] for name in names]
+        total = int(rate * duration)
+        result = LoadResult(rate,duration,len(self.consoles))
+        lock = Lock()
+        sequence = iter(range(total))
+        start = monotonic() + 0.01
+
+        def worker(console):
+            while True:
+                with lock:
+                    n = next(sequence,None)
+                    if n is None:
+                        return
+                    name = rng.choices(names,weights)[0]
+                template = _COMMANDS[name]
+                message = template % (n) if '%d' in template else template
+                delay = start + n / rate - monotonic()
+                if delay > 0:
+                    sleep(delay)
+                try:
+                    self._request(console,message,result,lock)
+                except OSError:
+                    with lock:
+                        result.sent += 1
+
+        threads = [Thread(target=worker,args=(c,),daemon=True)
+                   for c in self.consoles]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        result.duration = max(duration,monotonic() - start)
+        return result
+
+    def flood_threshold(self,start=1.0,factor=1.5,max_rate=500.0,
+                        duration=5.0,drop_limit=0.05,pause=2.0):
+        '''
+        :param: start      - float first rate tried, requests per second
+        :param: factor     - float the rate grows by between runs
+        :param: max_rate   - float highest rate tried
+        :param: duration   - float seconds each rate is run for
+        :param: drop_limit - float drop rate counted as flood protection
+        :param: pause      - float seconds of silence between runs, to let
+                             the server forget the previous one
+        :return: (rate or None,list of LoadResult), rate being the first
+                 one whose drop rate passed drop_limit
+
+        Stops at the first such rate, or at max_rate.
+        '''
+        results = []
+        rate = start
+        while rate <= max_rate:
+            result = self.run(rate,duration)
+            results.append(result)
+            if result.drop_rate > drop_limit:
+                return rate,results
+            rate *= factor
+            sleep(pause)
+        return None,results
+
+    def close(self):
+        '''
+        Closes the consoles' sockets.
+        '''
+        for console in self.consoles:
+            sock = getattr(console,'_udp_sock',None)
+            if sock is not None:
+                sock.close()
+
+
+class StandInServer(object):
+    '''
+    Local CoD4-like rcon server with per-address flood protection.
+    '''
+    _HEADER = b'\xff\xff\xff\xffprint\n'
+    _PREFIX = b'\xff\xff\xff\xff'
+    _RCON_CMD = b'rcon '
+    _CHUNKSZ = 1024
+
+    def __init__(self,password='',host='127.0.0.1',port=0,rate=10.0,burst=20,
+                 players=12,delay=0.0):
+        '''
+        :param: password - string rcon password, any is accepted if empty
+        :param: host     - string address to listen on
+        :param: port     - integer port, 0 picks a free one
+        :param: rate     - float requests per second allowed per address,
+                           None disables flood protection
+        :param: burst    - integer requests an idle address may send at once
+        :param: players  - integer players listed by 'status'
+        :param: delay    - float seconds spent on each command
+        '''
+        self.password = password
+        self.rate = rate
+        self.burst = burst
+        self.delay = delay
+        self.players = players
+        self.dvars = {'sv_hostname':'PyRcon stand-in','mapname':'mp_crash',
+                      'g_gametype':'war','sv_maxclients':'32',
+                      'version':'CoD4 MP 1.7 build 568','pyrcon_loadtest':'0'}
+        self.received = 0
+        self.answered = 0
+        self.flooded = 0
+        self._buckets = {}
+        self._stop = Event()
+        self._thread = None
+        self.sock = socket(AF_INET,SOCK_DGRAM)
+        self.sock.bind((host,port))
+
+    def __repr__(self):
+        return '<%s(%s:%s,rate=%s,burst=%s)>' % (self.__class__.__name__,
+                                                 self.host,self.port,
+                                                 self.rate,self.burst)
+
+    @property
+    def host(self):
+        return self.sock.getsockname()[0]
+
+    @property
+    def port(self):
+        return self.sock.getsockname()[1]
+
+    def _allow(self,address):
+        if self.rate is None:
+            return True
+        now = monotonic()
+        tokens,then = self._buckets.get(address,(float(self.burst),now))
+        tokens = min(float(self.burst),tokens + (now - then) * self.rate)
+        if tokens < 1.0:
+            self._buckets[address] = (tokens,now)
+            return False
+        self._buckets[address] = (tokens - 1.0,now)
+        return True
+
+    def _status(self):
+        lines = ['map: %s' % (self.dvars['mapname']),
+                 'num score ping guid                             name'
+                 '            lastmsg address               qport rate',
+                 '--- ----- ---- -------------------------------- ---------------'
+                 ' ------- --------------------- ----- -----']
+        for n in range(self.players):
+            lines.append('%3d %5d %4d %032x %-15s %7d %-21s %5d %5d' % (
+                n,n * 10,40 + n * 5,n,'player%d^7' % (n),0,
+                '10.0.%d.%d:28960' % (n // 250,n % 250 + 1),1000 + n,25000))
+        return '\n'.join(lines) + '\n'
+
+    def _dvardump(self,prefix):
+        found = sorted((k,v) for k,v in self.dvars.items() if k.startswith(prefix))
+        lines = ['=' * 35]
+        lines.extend('%s "%s"' % kv for kv in found)
+        lines.append('=' * 35)
+        lines.append('%d total dvars' % (len(found)))
+        lines.append('%d dvar indexes' % (len(found)))
+        return '\n'.join(lines) + '\n'
+
+    def _answer(self,text):
+        verb,_,args = text.partition(' ')
+        if verb == 'status':
+            return self._status()
+        if verb == 'dvardump':
+            return self._dvardump(args.strip())
+        if verb == 'set':
+            name,_,value = args.partition(' ')
+            self.dvars[name] = value.strip('"')
+            return ''
+        if verb == 'say':
+            return 'console: %s\n' % (args)
+        if verb in self.dvars:
+            return '"%s" is:"%s^7" default:"%s^7"\n' % (verb,self.dvars[verb],
+                                                        self.dvars[verb])
+        return 'Unknown command "%s"\n' % (verb)
+
+    def _handle(self,data,address):
+        self.received += 1
+        if not data.startswith(self._PREFIX):
+            return
+        data = data[len(self._PREFIX):]
+        if not data.startswith(self._RCON_CMD):
+            data = data[1:]                     # CoD sequence byte
+        if not data.startswith(self._RCON_CMD):
+            return
+        if not self._allow(address[0]):
+            self.flooded += 1
+            return
+        password,_,text = data[len(self._RCON_CMD):].decode('utf-8','replace').partition(' ')
+        if self.password and password != self.password:
+            reply = 'Bad rconpassword.\n'
+        else:
+            if self.delay:
+                sleep(self.delay)
+            reply = self._answer(text.strip())
+        payload = reply.encode('utf-8')
+        for i in range(0,max(1,len(payload)),self._CHUNKSZ):
+            self.sock.sendto(self._HEADER + payload[i:i + self._CHUNKSZ],address)
+        self.answered += 1
+
+    def serve(self):
+        '''
+        Answers requests until stop() is called.
+        '''
+        while not self._stop.is_set():
+            ready,_,_ = select([self.sock],[],[],0.1)
+            if not ready:
+                continue
+            try:
+                data,address = self.sock.recvfrom(4096)
+            except OSError:
+                continue
+            self._handle(data,address)
+
+    def start(self):
+        '''
+        Starts serving in a background thread.
+        '''
+        self._stop.clear()
+        self._thread = Thread(target=self.serve,daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''
+        Stops serving and closes the socket.
+        '''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.sock.close()
+
+
+def main(argv=None):
+    '''
+    Entry point for 'python -m PyRcon.LoadTest'.
+    '''
+    parser = argparse.ArgumentParser(prog='pyrcon-loadtest',
+                                     description='CoD4 rcon load tester')
+    parser.add_argument('server',nargs='?',metavar='HOST[:PORT]')
+    parser.add_argument('-p','--password',
+                        default=os.environ.get('PYRCON_PASSWORD'))
+    parser.add_argument('-P','--port',type=int,default=28960)
+    parser.add_argument('-j','--concurrency',type=int,default=8)
+    parser.add_argument('-m','--mix',type=parse_mix,default=None,
+                        help='weights, e.g. status=4,dvardump=1,set=1,say=1')
+    parser.add_argument('-r','--rate',type=float,default=10.0)
+    parser.add_argument('-d','--duration',type=float,default=10.0)
+    parser.add_argument('-t','--timeout',type=float,default=1.0)
+    parser.add_argument('--ramp',action='store_true',
+                        help='raise the rate until flood protection drops requests')
+    parser.add_argument('--max-rate',type=float,default=500.0)
+    parser.add_argument('--drop-limit',type=float,default=0.05)
+    parser.add_argument('--stand-in',action='store_true',
+                        help='test a local stand-in server instead')
+    parser.add_argument('--stand-in-rate',type=float,default=10.0)
+    parser.add_argument('--stand-in-burst',type=int,default=20)
+    args = parser.parse_args(argv)
+
+    standin = None
+    if args.stand_in:
+        standin = StandInServer(args.password or '',rate=args.stand_in_rate,
+                                burst=args.stand_in_burst).start()
+        host,port = standin.host,standin.port
+    elif not args.server:
+        parser.error('no server given')
+    elif not args.password:
+        parser.error('no rcon password, use -p or $PYRCON_PASSWORD')
+    else:
+        host,port = parse_address(args.server,args.port)
+
+    tester = LoadTester(args.password or '',host,port,args.concurrency,
+                        args.mix,args.timeout)
+    try:
+        if args.ramp:
+            threshold,results = tester.flood_threshold(
+                start=max(1.0,args.rate / 10.0),max_rate=args.max_rate,
+                duration=args.duration,drop_limit=args.drop_limit)
+            for result in results:
+                print(result.report())
+            if threshold is None:
+                print('no flood protection seen up to %.1f/s' % (args.max_rate))
+            else:
+                print('flood protection drops requests from %.1f/s' % (threshold))
+        else:
+            print(tester.run(args.rate,args.duration).report())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tester.close()
+        if standin is not None:
+            standin.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
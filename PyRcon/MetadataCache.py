@@ -0,0 +1,154 @@
+'''
+On-disk cache of static server metadata.
+
+Replies to 'cmdlist', 'dvarlist', 'path' and friends span many
+packets and take a long time to collect, but only change when the
+server software does.  A MetadataCache keeps them on disk, one
+zlib compressed JSON file per server address, tagged with the
+server's build string taken from the 'version' dvar.
+
+Files are read the first time a server's metadata is asked for.
+After that the build string is re-checked at most once every 'ttl'
+seconds with a single small dvardump; if it changed, everything
+cached for that server is dropped and fetched again on demand.
+'''
+
+import json
+import os
+import zlib
+from threading import RLock
+from time import monotonic
+
+from .Exceptions import NoResponseError
+
+
+class MetadataCache(object):
+    '''
+    Cache of slow-changing server metadata keyed by address and build.
+    '''
+    _MAGIC = b'PyRconMD1\n'
+    _DEFAULT_DIR = os.path.join('~','.cache','pyrcon')
+
+    def __init__(self,directory=None,ttl=300.0):
+        '''
+        :param: directory - string directory for cache files,
+                            defaults to ~/.cache/pyrcon
+        :param: ttl       - float seconds between build checks
+        '''
+        if directory is None:
+            directory = os.path.expanduser(self._DEFAULT_DIR)
+        self.directory = directory
+        self.ttl = ttl
+        self._lock = RLock()
+        self._servers = {}
+
+    def __repr__(self):
+        return '<%s(%s,%s)>' % (self.__class__.__name__,
+                                self.directory,
+                                self.ttl)
+
+    def _filename(self,address):
+        host,port = address[:2]
+        return os.path.join(self.directory,
+                            '%s_%s.cache' % (host.replace(':','_'),port))
+
+    def _read(self,address):
+        try:
+            with open(self._filename(address),'rb') as fp:
+                data = fp.read()
+        except (IOError,OSError):
+            return {'build':None,'entries':{}}
+        if not data.startswith(self._MAGIC):
+            return {'build':None,'entries':{}}
+        try:
+            return json.loads(zlib.decompress(data[len(self._MAGIC):]).decode())
+        except (zlib.error,ValueError):
+            return {'build':None,'entries':{}}
+
+    def _write(self,address,record):
+        filename = self._filename(address)
+        data = json.dumps(record,separators=(',',':')).encode()
+        try:
+            os.makedirs(self.directory,exist_ok=True)
+            tmp = '%s.%d.tmp' % (filename,os.getpid())
+            with open(tmp,'wb') as fp:
+                fp.write(self._MAGIC + zlib.compress(data,9))
+            os.replace(tmp,filename)
+        except (IOError,OSError):
+            pass
+
+    def build(self,console):
+        '''
+        :param: console - RemoteConsole
+        :return: string build identifier reported by the server
+        '''
+        try:
+            return console._get_dvar_value('version')
+        except KeyError:
+            return console._get_dvar_value('shortversion')
+
+    def _server(self,console):
+        '''
+        Returns the cache record for console's address, loading it from
+        disk and revalidating its build as needed.  The build query runs
+        outside the lock, so a slow server only holds up its own lookups.
+        '''
+        address = console.address
+        key = '%s:%s' % tuple(address[:2])
+        with self._lock:
+            server = self._servers.get(key)
+            if server is None:
+                server = self._servers.setdefault(key,{
+                    'record':self._read(address),'checked':None})
+            checked = server['checked']
+            if checked is not None and monotonic() - checked <= self.ttl:
+                return server
+
+        build = self.build(console)
+
+        with self._lock:
+            if build != server['record']['build']:
+                server['record'] = {'build':build,'entries':{}}
+            server['checked'] = monotonic()
+        return server
+
+    def get(self,console,name,fetch):
+        '''
+        :param: console - RemoteConsole
+        :param: name    - string name of the cached item
+        :param: fetch   - callable returning a fresh JSON-able value
+        :return: cached or freshly fetched value
+
+        If the server can't be asked for its build the value is fetched
+        directly and nothing is cached.
+        '''
+        try:
+            server = self._server(console)
+        except (NoResponseError,KeyError,ValueError,IndexError):
+            return fetch()
+
+        with self._lock:
+            entries = server['record']['entries']
+            if name in entries:
+                return entries[name]
+
+        value = fetch()
+
+        with self._lock:
+            server['record']['entries'][name] = value
+            self._write(console.address,server['record'])
+        return value
+
+    def invalidate(self,console):
+        '''
+        :param: console - RemoteConsole
+
+        Forgets everything cached for console's server.
+        '''
+        key = '%s:%s' % tuple(console.address[:2])
+        with self._lock:
+            self._servers.pop(key,None)
+            try:
+                os.remove(self._filename(console.address))
+            except (IOError,OSError):
+                pass
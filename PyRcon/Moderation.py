@@ -0,0 +1,404 @@
+'''
+Fleet-wide ban enforcement.
+
+A BanIndex holds banned GUIDs, IP addresses and player names in a
+single hash table.  Names are compared after removing color codes and
+quotes and folding case.  The table can be fronted by a Bloom filter,
+but that is off by default: hashing a key in Python costs more than
+the dictionary lookup it would save.
+
+A Moderator polls the 'players' table of every console, checks each
+player against the index in one pass and enforces the matches,
+grouped per server and rate limited so a burst of kicks does not
+trip the server's own flood protection; every command sent, polls
+included, costs a token.  Kicks and bans go by slot number, so just
+before a server's batch is enforced its slots are checked with one
+fresh 'status' to still hold the matched players; a slot taken over by
+someone else in the meantime is left alone.
+
+  index = BanIndex()
+  index.add(guid='0123456789abcdef0123456789abcdef',reason='aimbot')
+  Moderator(index).sweep(consoles)
+'''
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
+from math import ceil, log
+from threading import Lock
+from time import monotonic, sleep
+
+from .Exceptions import NoResponseError, UsageError, ServerPasswordNotSet
+from .Exceptions import PlayerNotFound
+
+_COLOR = re.compile(r'\^.')
+
+
+def clean_name(name):
+    '''
+    :param: name - string player name as shown by 'status'
+    :return: string with color codes and quotes removed, lower cased
+    '''
+    return _COLOR.sub('',name).replace('"','').strip().lower()
+
+
+class BloomFilter(object):
+    '''
+    A fixed size Bloom filter over strings.
+    '''
+    __slots__ = ('bits','size','hashes')
+
+    def __init__(self,capacity,error_rate=0.001):
+        '''
+        :param: capacity   - integer number of items expected
+        :param: error_rate - float acceptable false positive rate
+        '''
+        capacity = max(1,capacity)
+        self.size = int(ceil(-capacity * log(error_rate) / (log(2) ** 2)))
+        self.hashes = max(1,int(round(self.size / capacity * log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def __repr__(self):
+        return '<%s(%d bits,%d hashes)>' % (self.__class__.__name__,
+                                            self.size,
+                                            self.hashes)
+
+    def _positions(self,key):
+        digest = blake2b(key.encode(),digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8],'little')
+        h2 = int.from_bytes(digest[8:],'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self,key):
+        '''
+        :param: key - string
+        '''
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self,key):
+        for p in self._positions(key):
+            if not self.bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+
+class BanEntry(object):
+    '''
+    One ban: what to do with a matching player and why.
+    '''
+    __slots__ = ('key','action','reason')
+
+    _ACTIONS = ('kick','tempban','ban')
+
+    def __init__(self,key,action='ban',reason=''):
+        '''
+        :param: key    - string 'guid:...', 'ip:...' or 'name:...'
+        :param: action - string 'kick', 'tempban' or 'ban'
+        :param: reason - string
+        '''
+        if action not in self._ACTIONS:
+            raise ValueError('%s not one of %s' % (action,self._ACTIONS))
+        self.key = key
+        self.action = action
+        self.reason = reason
+
+    def __repr__(self):
+        return '<%s(%s,%s,%r)>' % (self.__class__.__name__,
+                                   self.key,
+                                   self.action,
+                                   self.reason)
+
+
+class BanIndex(object):
+    '''
+    Banned GUIDs, IPs and cleaned names, shared across a fleet.
+    '''
+
+    def __init__(self,bloom=False,capacity=100000,error_rate=0.001):
+        '''
+        :param: bloom      - bool, front the table with a Bloom filter
+        :param: capacity   - integer bans expected, sizes the filter
+        :param: error_rate - float filter false positive rate
+        '''
+        self._lock = Lock()
+        self._entries = {}
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._bloom = BloomFilter(capacity,error_rate) if bloom else None
+
+    def __repr__(self):
+        return '<%s(%d entries,bloom=%s)>' % (self.__class__.__name__,
+                                              len(self),
+                                              self._bloom is not None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _keys(self,guid,ip,name):
+        keys = []
+        if guid:
+            keys.append('guid:' + guid.lower())
+        if ip:
+            keys.append('ip:' + ip)
+        if name:
+            keys.append('name:' + clean_name(name))
+        return keys
+
+    def keys(self,player):
+        '''
+        :param: player - dictionary, one row of RemoteConsole.players
+        :return: list of index keys identifying the player
+        '''
+        return self._keys(player.get('guid'),
+                          player.get('address','').rpartition(':')[0],
+                          player.get('name'))
+
+    def add(self,guid=None,ip=None,name=None,action='ban',reason=''):
+        '''
+        :param: guid   - string player GUID
+        :param: ip     - string IP address
+        :param: name   - string player name, cleaned before indexing
+        :param: action - string 'kick', 'tempban' or 'ban'
+        :param: reason - string
+
+        Each of guid, ip and name given is indexed as its own ban.
+        '''
+        keys = self._keys(guid,ip,name)
+        with self._lock:
+            for key in keys:
+                self._entries[key] = BanEntry(key,action,reason)
+                if self._bloom is not None:
+                    self._bloom.add(key)
+
+    def remove(self,guid=None,ip=None,name=None):
+        '''
+        :param: guid - string player GUID
+        :param: ip   - string IP address
+        :param: name - string player name
+
+        A Bloom filter can not forget, removed keys still pass it and
+        cost a table lookup until rebuild() is called.
+        '''
+        keys = self._keys(guid,ip,name)
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key,None)
+
+    def rebuild(self):
+        '''
+        Rebuilds the Bloom filter from the current entries.
+        '''
+        if self._bloom is None:
+            return
+        with self._lock:
+            bloom = BloomFilter(max(self._capacity,len(self._entries)),
+                                self._error_rate)
+            for key in self._entries:
+                bloom.add(key)
+            self._bloom = bloom
+
+    def match(self,player):
+        '''
+        :param: player - dictionary, one row of RemoteConsole.players
+        :return: BanEntry or None
+        '''
+        bloom = self._bloom
+        for key in self.keys(player):
+            if bloom is not None and key not in bloom:
+                continue
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry
+        return None
+
+    def load(self,path):
+        '''
+        :param: path - string filename
+
+        Reads tab separated 'key action reason' lines as written by
+        save().  Keys may hold spaces, player names often do.
+        '''
+        with open(path) as fp:
+            for line in fp:
+                fields = line.rstrip('\n').split('\t',2)
+                if len(fields) < 2 or line.startswith('#'):
+                    continue
+                kind,_,value = fields[0].partition(':')
+                if kind not in ('guid','ip','name'):
+                    raise ValueError('bad ban key %s' % (fields[0]))
+                reason = fields[2] if len(fields) > 2 else ''
+                self.add(action=fields[1],reason=reason,**{kind:value})
+
+    def save(self,path):
+        '''
+        :param: path - string filename
+
+        Tabs and line breaks in reasons are written as spaces.
+        '''
+        with self._lock:
+            entries = sorted(self._entries.values(),key=lambda e:e.key)
+        with open(path,'w') as fp:
+            for entry in entries:
+                reason = entry.reason.replace('\t',' ').replace('\n',' ')
+                fp.write('%s\t%s\t%s\n' % (entry.key,entry.action,reason))
+
+
+class RateLimiter(object):
+    '''
+    Token bucket, acquire() blocks until a token is available.
+    '''
+
+    def __init__(self,rate,burst=1):
+        '''
+        :param: rate  - float tokens added per second
+        :param: burst - integer maximum tokens held
+        '''
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._stamp = monotonic()
+        self._lock = Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._tokens = min(self.burst,
+                                   self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            sleep(wait)
+
+
+class Moderator(object):
+    '''
+    Checks polled players against a BanIndex and enforces matches.
+    '''
+    _ERRORS = (NoResponseError,UsageError,ServerPasswordNotSet,
+               PlayerNotFound,ValueError,IndexError,OSError)
+
+    def __init__(self,index,rate=2.0,burst=4,concurrency=16):
+        '''
+        :param: index       - BanIndex
+        :param: rate        - float commands per second sent to one server
+        :param: burst       - integer commands one server may get at once
+        :param: concurrency - integer servers polled or enforced at once
+        '''
+        self.index = index
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self._limiters = {}
+        self._lock = Lock()
+
+    def __repr__(self):
+        return '<%s(%r,%s/s)>' % (self.__class__.__name__,self.index,self.rate)
+
+    def _limiter(self,console):
+        key = (console.host,console.port)
+        with self._lock:
+            try:
+                return self._limiters[key]
+            except KeyError:
+                return self._limiters.setdefault(key,RateLimiter(self.rate,
+                                                                 self.burst))
+
+    def scan(self,tables):
+        '''
+        :param: tables - iterable of (console,players) pairs, players as
+                         returned by RemoteConsole.players
+        :return: list of (console,player,BanEntry) tuples
+        '''
+        match = self.index.match
+        found = []
+        for console,players in tables:
+            for player in players.values():
+                entry = match(player)
+                if entry is not None:
+                    found.append((console,player,entry))
+        return found
+
+    def _same_player(self,player,current):
+        guid = player.get('guid')
+        if guid and guid != '0':
+            return current.get('guid') == guid
+        return clean_name(current.get('name','')) == clean_name(player.get('name',''))
+
+    def _slot(self,current,player):
+        '''
+        Returns the slot number still held by player in current, the
+        server's players table, raising PlayerNotFound if the player
+        has left it.
+        '''
+        number = int(player['num'])
+        for row in current.values():
+            if row.get('num') == player['num']:
+                if self._same_player(player,row):
+                    return number
+                break
+        raise PlayerNotFound(player.get('name'),number)
+
+    def _enforce_one(self,console,matches):
+        done = []
+        limiter = self._limiter(console)
+        limiter.acquire()
+        try:
+            current = console.players
+        except self._ERRORS as error:
+            return [(console,player,entry,error) for player,entry in matches]
+        for player,entry in matches:
+            try:
+                number = self._slot(current,player)
+                limiter.acquire()
+                if entry.action == 'kick':
+                    console.kick(number)
+                else:
+                    console.ban(number,temporary=(entry.action == 'tempban'))
+                done.append((console,player,entry,None))
+            except self._ERRORS as error:
+                done.append((console,player,entry,error))
+        return done
+
+    def enforce(self,matches):
+        '''
+        :param: matches - list of (console,player,BanEntry) from scan()
+        :return: list of (console,player,BanEntry,error) tuples,
+                 error is None where the command succeeded and
+                 PlayerNotFound where the player had left the slot
+
+        Matches are batched per server; servers are worked in parallel
+        and each server's commands, including the one 'status' poll
+        confirming its batch, are paced by its own rate limit.
+        '''
+        batches = {}
+        for console,player,entry in matches:
+            batches.setdefault(id(console),(console,[]))[1].append((player,entry))
+        results = []
+        if not batches:
+            return results
+        with ThreadPoolExecutor(max_workers=max(1,self.concurrency)) as pool:
+            for done in pool.map(lambda b:self._enforce_one(*b),batches.values()):
+                results.extend(done)
+        return results
+
+    def _players(self,console):
+        self._limiter(console).acquire()
+        try:
+            return console,console.players
+        except self._ERRORS:
+            return console,{}
+
+    def sweep(self,consoles):
+        '''
+        :param: consoles - list of RemoteConsoles
+        :return: list of (console,player,BanEntry,error), see enforce()
+
+        Polls every console's players, scans them and enforces matches.
+        '''
+        with ThreadPoolExecutor(max_workers=max(1,self.concurrency)) as pool:
+            tables = list(pool.map(self._players,consoles))
+        return self.enforce(self.scan(tables))
@@ -5,9 +5,12 @@ XXX Needs more docs
 
 '''
 
-from socket import socket, AF_INET,SOCK_DGRAM,MSG_WAITALL,MSG_PEEK
+from socket import socket, getaddrinfo, AF_INET,AF_UNSPEC,SOCK_DGRAM,MSG_WAITALL,MSG_PEEK
 from select import select
-from .Exceptions import NoResponseError
+from threading import Lock
+from time import monotonic
+from .Exceptions import NoResponseError, CircuitOpenError
+from .LatencyProfile import LatencyProfile
 
 class BaseRemoteConsole(object):
     '''
@@ -17,15 +20,30 @@ class BaseRemoteConsole(object):
     _CHUNKSZ = 2048
     _PREFIX_BYTE = 0xff
     _RCON_CMD = 'rcon '
-    def __init__(self,password,hostname='localhost',port=28960):
+    _TIMEOUT = 0.05
+    _RETRIES = 2
+    _TIMEOUTS = {}
+    _RESOLVE_TTL = 300.0
+    capture = None
+    transport = None
+    breaker = None
+    def __init__(self,password,hostname='localhost',port=28960,profile=None,
+                 connected=False):
         '''
-        :param: password - string password for server
-        :param: hostname - string, name or IP address of server
-        :param: port     - integer, port number to contact on hostname
+        :param: password  - string password for server
+        :param: hostname  - string, name, IPv4 or IPv6 address of server
+        :param: port      - integer, port number to contact on hostname
+        :param: profile   - LatencyProfile, may be shared between consoles
+        :param: connected - bool, connect() the UDP socket to the server
         '''
         self.passwd = password
         self.host = hostname
         self.port = port
+        self.connected = connected
+        self._io_lock = Lock()
+        if profile is None:
+            profile = LatencyProfile()
+        self.profile = profile
 
     def __repr__(self):
         return '<%s(%s,%s,%s)>' % (self.__class__.__name__,
@@ -65,22 +83,77 @@ class BaseRemoteConsole(object):
     @property
     def udp_sock(self):
         '''
-        An (AF_INET,SOCK_DGRAM) socket
+        A SOCK_DGRAM socket of the server address' family, connected
+        to the server if self.connected is True.
         '''
         try:
             return self._udp_sock
         except AttributeError:
-            self._udp_sock = socket(AF_INET,SOCK_DGRAM)
+            sockaddr = self.sockaddr
+            self._udp_sock = socket(self._resolved[0],SOCK_DGRAM)
+            if self.connected:
+                self._udp_sock.connect(sockaddr)
         return self._udp_sock
 
     @property
     def address(self):
         '''
-        A tuple of (host,port), determines where messages are sent.
+        A tuple of (host,port) naming the server.
         '''
         return (self.host,self.port)
+
+    @property
+    def sockaddr(self):
+        '''
+        The resolved socket address messages are sent to.
+
+        The host is resolved once and then again every _RESOLVE_TTL
+        seconds, or when host or port change.  IPv4 addresses are
+        preferred over IPv6 ones for names that have both, as game
+        servers rarely listen on both.  If re-resolving fails the
+        previous address is kept.  A socket of the wrong family is
+        replaced, a connected socket is re-connected.
+        '''
+        now = monotonic()
+        resolved = getattr(self,'_resolved',None)
+        if resolved is not None:
+            family,sockaddr,expires,address = resolved
+            if now < expires and address == self.address:
+                return sockaddr
+        try:
+            found = getaddrinfo(self.host,self.port,AF_UNSPEC,SOCK_DGRAM)
+            found.sort(key=lambda info:info[0] != AF_INET)
+            family,_,_,_,sockaddr = found[0]
+        except OSError:
+            if resolved is None or resolved[3] != self.address:
+                raise
+            family,sockaddr = resolved[:2]
+        self._resolved = (family,sockaddr,now + self._RESOLVE_TTL,self.address)
+
+        sock = getattr(self,'_udp_sock',None)
+        if sock is not None:
+            if sock.family != family:
+                sock.close()
+                del self._udp_sock
+            elif self.connected and (resolved is None or resolved[1] != sockaddr):
+                sock.connect(sockaddr)
+        return sockaddr
     
-    def send(self,message,encoding,timeout,retries):
+    def timeout_for(self,message):
+        '''
+        :param: message - string holding command to send to server
+        :return: tuple (timeout,retries)
+
+        The timeout and retries send() will use for message when the
+        caller does not supply them.  Derived from the latency profile
+        once enough replies to the command's verb have been seen,
+        otherwise taken from _TIMEOUTS or the class defaults.
+        '''
+        verb = message.partition(' ')[0]
+        default = self._TIMEOUTS.get(verb,(self._TIMEOUT,self._RETRIES))
+        return self.profile.timeout_for(self.address,verb,default)
+
+    def send(self,message,encoding,timeout=None,retries=None):
         '''
         :param: message  - string holding command to send to server
         :param: encoding - string, typically 'utf-8'   XXX necessary?
@@ -94,40 +167,175 @@ class BaseRemoteConsole(object):
 
         The Quake-style protocol does not have an EOM component, so a
         timeout scheme is used to decide when the response is complete.
+        If timeout or retries are None, they are chosen by timeout_for()
+        and the reply timing is recorded in the latency profile.
 
         If no data is received after (timeout * retries) seconds, the
         NoResponseError exception is raised which will contain the
         message that was not acknowledged and the timeout and retries
         used.
 
+        If the console has a circuit breaker that is open, the message
+        is not sent and CircuitOpenError is raised straight away.
+
         '''
+
+        breaker = self.breaker
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError(message,self.address)
+
+        if timeout is None or retries is None:
+            t,r = self.timeout_for(message)
+            if timeout is None:
+                timeout = t
+            if retries is None:
+                retries = r
+
+        verb = message.partition(' ')[0]
         
         data = self.prefix + bytes('%s %s'%(self.passwd,message),encoding)
-        
-        self.udp_sock.sendto(data,self.address)
-
-        tries = 0
-        chunks = []
-        while True:
-            read_ready,_,_ = select([self.udp_sock],[],[],timeout)
-            if self.udp_sock in read_ready:
-                data = self.udp_sock.recv(self._CHUNKSZ)
-                if  data.startswith(self.reply_header):
-                    chunks.append(data[len(self.reply_header):])
+
+        try:
+            chunks = self._transact(data,self.reply_header,verb,message,
+                                    timeout,retries)
+        except NoResponseError:
+            if breaker is not None:
+                breaker.failure()
+            raise
+        if breaker is not None:
+            breaker.success()
+
+        text = ''.join([chunk.decode() for chunk in chunks])
+
+        return text
+
+    def _transact(self,data,header,verb,message,timeout,retries,single=False):
+        '''
+        :param: data    - bytes datagram to send
+        :param: header  - bytes expected at the start of each reply
+        :param: verb    - string key for the latency profile
+        :param: message - string reported in NoResponseError
+        :param: timeout - float seconds to wait for a response
+        :param: retries - integer number of times to timeout before failing
+        :param: single  - bool, the reply is one datagram, stop once it arrives
+        :return: list of reply payloads with the header removed
+
+        Sends data and collects reply datagrams until the socket has been
+        quiet for timeout seconds retries+1 times, recording the reply
+        timing in the latency profile.  Transactions on one console are
+        serialized, so threads sharing it never read each other's replies.
+        '''
+        with self._io_lock:
+            self.profile.sent(self.address,verb)
+            start = monotonic()
+            self._transmit(data)
+
+            tries = 0
+            chunks = []
+            first = None
+            gap = 0.0
+            while True:
+                data = self._receive(timeout)
+                if data is not None:
+                    if  data.startswith(header):
+                        now = monotonic()
+                        if first is None:
+                            first = now - start
+                        else:
+                            gap = max(gap,now - last)
+                        last = now
+                        chunks.append(data[len(header):])
+                        if single:
+                            break
+                    else:
+                        raise ValueError(data)
                 else:
-                    raise ValueError(data)
-            else:
-                tries += 1
-                
-            if tries > retries:
-                break
+                    tries += 1
+
+                if tries > retries:
+                    break
 
         if len(chunks) == 0:
+            self.profile.record_timeout(self.address,verb)
             raise NoResponseError(message,timeout,retries)
 
-        text = ''.join([chunk.decode() for chunk in chunks])
+        self.profile.record(self.address,verb,first,gap)
 
-        return text
+        return chunks
+
+    def _transmit(self,data):
+        '''
+        :param: data - bytes datagram to send to the server
+
+        Sends through self.transport if one is set, otherwise through
+        udp_sock.  Datagrams are written to self.capture if set.
+        '''
+        if self.capture is not None:
+            self.capture.record(self.capture.OUT,data)
+        if self.transport is not None:
+            self.transport.transmit(data)
+        elif self.connected:
+            self.sockaddr           # re-resolves and re-connects if due
+            self.udp_sock.send(data)
+        else:
+            sockaddr = self.sockaddr    # may replace udp_sock, read it after
+            self.udp_sock.sendto(data,sockaddr)
+
+    def _receive(self,timeout):
+        '''
+        :param: timeout - float seconds to wait for a datagram
+        :return: bytes datagram or None if nothing arrived in time
+
+        On an unconnected socket, datagrams from any address but the
+        server's are dropped.  An ICMP error reported on a connected
+        socket counts as silence.
+        '''
+        if self.transport is not None:
+            data = self.transport.receive(timeout)
+        else:
+            sock = self.udp_sock
+            expected = self._resolved[1][:2]
+            deadline = monotonic() + timeout
+            while True:
+                read_ready,_,_ = select([sock],[],[],
+                                        max(0.0,deadline - monotonic()))
+                if sock not in read_ready:
+                    return None
+                try:
+                    data,source = sock.recvfrom(self._CHUNKSZ)
+                except ConnectionRefusedError:
+                    return None
+                if self.connected or source[:2] == expected:
+                    break
+        if data is not None and self.capture is not None:
+            self.capture.record(self.capture.IN,data)
+        return data
+
+    def getinfo(self,timeout=None,retries=None):
+        '''
+        :param: timeout  - float seconds to wait for a response
+        :param: retries  - integer number of times to timeout before failing
+        :return: dictionary of the server's info string
+
+        Sends the out-of-band 'getinfo' query, which needs no rcon
+        password and is answered with a single small datagram.  This
+        is the cheapest way to see whether a server is up and which
+        map it is running.
+        '''
+        if timeout is None or retries is None:
+            t,r = self.timeout_for('getinfo')
+            if timeout is None:
+                timeout = t
+            if retries is None:
+                retries = r
+
+        data = bytes([self._PREFIX_BYTE] * 4) + b'getinfo PyRcon'
+        header = bytes([self._PREFIX_BYTE] * 4) + b'infoResponse\n'
+        chunk = self._transact(data,header,'getinfo','getinfo',
+                               timeout,retries,single=True)[0]
+
+        fields = chunk.decode(errors='replace').strip().split('\\')[1:]
+        return dict(zip(fields[0::2],fields[1::2]))
     
     def clean(self,text,strdefs,emptyString=''):
         '''
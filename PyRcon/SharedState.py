@@ -0,0 +1,250 @@
+'''
+Fleet state shared between processes on one host.
+
+When several tools on the same host watch the same servers, each one
+polling through its own consoles multiplies the rcon load on every
+server.  Instead one process polls, normally with a ShardedCollector,
+and publishes each server's latest players, dvars and serverinfo into
+a shared memory segment; the others attach to the segment and read
+from it without sending anything to the servers.
+
+The segment holds a header followed by one fixed size slot per
+server.  Each slot is guarded by a sequence counter (a seqlock): the
+single publisher makes it odd before writing the slot and even again
+afterwards, and a reader retries any copy during which the counter
+was odd or changed.  Readers take no lock and never block the
+publisher.  Slot payloads are Collector.encode() marshal data and a
+reader only decodes a slot again when its counter has moved on.
+
+  # collector process
+  state = FleetStatePublisher('pyrcon-fleet',servers)
+  state.publish_from(ShardedCollector(servers,interval=30))
+
+  # any other process
+  state = FleetStateReader('pyrcon-fleet')
+  state.get('game1',28960).players
+'''
+
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from struct import Struct
+from threading import Lock
+from time import sleep
+
+from .Collector import decode, encode
+
+
+_MAGIC = b'PyRconS1'
+_HEADER = Struct('<8sII')
+_KEY_SIZE = 64
+_SLOT = Struct('<QI%ds' % (_KEY_SIZE))
+_SEQUENCE = Struct('<Q')
+
+
+def _key(host,port):
+    return ('%s:%s' % (host,port)).encode('utf-8')
+
+
+class FleetStatePublisher(object):
+    '''
+    Creates the shared segment and writes server results into it.
+    '''
+
+    def __init__(self,name,servers,slot_size=65536):
+        '''
+        :param: name      - string shared memory segment name
+        :param: servers   - list of (host,port) or (host,port,password)
+                            tuples, one slot is made for each
+        :param: slot_size - integer bytes available to each server
+        '''
+        keys = []
+        for server in servers:
+            key = _key(server[0],server[1])
+            if len(key) > _KEY_SIZE:
+                raise ValueError('server name too long',key)
+            if key not in keys:
+                keys.append(key)
+        self.name = name
+        self.slot_size = slot_size
+        self._stride = _SLOT.size + slot_size
+        self._slots = {key:i for i,key in enumerate(keys)}
+        self._lock = Lock()
+        self.shm = SharedMemory(name,create=True,
+                                size=_HEADER.size + self._stride * max(1,len(keys)))
+        buf = self.shm.buf
+        _HEADER.pack_into(buf,0,_MAGIC,len(keys),slot_size)
+        for key,i in self._slots.items():
+            _SLOT.pack_into(buf,self._offset(i),0,0,key)
+
+    def __repr__(self):
+        return '<%s(%s,%d slots)>' % (self.__class__.__name__,
+                                      self.name,
+                                      len(self._slots))
+
+    def _offset(self,slot):
+        return _HEADER.size + slot * self._stride
+
+    def publish(self,server):
+        '''
+        :param: server - CollectedServer
+        :return: integer version now held by the server's slot
+
+        Raises KeyError for servers without a slot and ValueError if the
+        encoded results do not fit in slot_size.
+        '''
+        data = encode(server.host,server.port,server.timestamp,
+                      server.players,server.dvars,server.serverinfo,
+                      tuple(server.errors.items()))
+        if len(data) > self.slot_size:
+            raise ValueError('%s:%s results exceed slot size' % (server.host,
+                                                                 server.port),
+                             len(data))
+        offset = self._offset(self._slots[_key(server.host,server.port)])
+        buf = self.shm.buf
+        with self._lock:
+            sequence = _SEQUENCE.unpack_from(buf,offset)[0]
+            _SEQUENCE.pack_into(buf,offset,sequence + 1)
+            start = offset + _SLOT.size
+            buf[start:start + len(data)] = data
+            _SLOT.pack_into(buf,offset,sequence + 1,len(data),
+                            _key(server.host,server.port))
+            _SEQUENCE.pack_into(buf,offset,sequence + 2)
+        return (sequence + 2) // 2
+
+    def publish_from(self,collector):
+        '''
+        :param: collector - ShardedCollector, started here if it has
+                            no workers yet
+
+        Publishes the collector's results as they arrive until its
+        workers finish.  Results too large for their slot are dropped.
+        '''
+        if not collector._workers:
+            collector.start()
+        try:
+            for server in collector.results():
+                try:
+                    self.publish(server)
+                except (KeyError,ValueError):
+                    pass
+        finally:
+            collector.stop()
+
+    def close(self,unlink=True):
+        '''
+        :param: unlink - bool, also remove the segment from the system
+
+        Readers attached to an unlinked segment keep the last state
+        published.
+        '''
+        self.shm.close()
+        if unlink:
+            # readers sharing this process's resource tracker may have
+            # unregistered the segment, unlink() expects it registered
+            resource_tracker.register(self.shm._name,'shared_memory')
+            self.shm.unlink()
+
+
+class FleetStateReader(object):
+    '''
+    Lock-free reader of a FleetStatePublisher's segment.
+    '''
+
+    def __init__(self,name):
+        '''
+        :param: name - string shared memory segment name
+        '''
+        self.name = name
+        self.shm = SharedMemory(name)
+        # the publisher owns the segment, so keep this process's
+        # resource tracker from unlinking it when the reader exits
+        try:
+            resource_tracker.unregister(self.shm._name,'shared_memory')
+        except (AttributeError,KeyError):
+            pass
+        buf = self.shm.buf
+        magic,slots,self.slot_size = _HEADER.unpack_from(buf,0)
+        if magic != _MAGIC:
+            self.shm.close()
+            raise ValueError('%s is not a fleet state segment' % (name))
+        self._stride = _SLOT.size + self.slot_size
+        self._slots = {}
+        for i in range(slots):
+            key = _SLOT.unpack_from(buf,self._offset(i))[2].rstrip(b'\0')
+            self._slots[key.decode('utf-8')] = i
+        self._cache = {}
+
+    def __repr__(self):
+        return '<%s(%s,%d slots)>' % (self.__class__.__name__,
+                                      self.name,
+                                      len(self._slots))
+
+    def _offset(self,slot):
+        return _HEADER.size + slot * self._stride
+
+    @property
+    def servers(self):
+        '''
+        List of 'host:port' strings with a slot in the segment.
+        '''
+        return list(self._slots)
+
+    def _read(self,slot):
+        offset = self._offset(slot)
+        buf = self.shm.buf
+        while True:
+            before = _SEQUENCE.unpack_from(buf,offset)[0]
+            if before & 1:
+                sleep(0)
+                continue
+            cached = self._cache.get(slot)
+            if cached is not None and cached[0] == before:
+                return before,cached[1]
+            length = _SLOT.unpack_from(buf,offset)[1]
+            start = offset + _SLOT.size
+            data = bytes(buf[start:start + min(length,self.slot_size)])
+            if _SEQUENCE.unpack_from(buf,offset)[0] == before:
+                break
+        server = decode(data) if before else None
+        self._cache[slot] = (before,server)
+        return before,server
+
+    def version(self,host,port):
+        '''
+        :param: host - string server name as given to the publisher
+        :param: port - integer server port
+        :return: integer count of results published for the server
+
+        Cheap enough to call in a loop to wait for fresh results.
+        '''
+        slot = self._slots[_key(host,port).decode('utf-8')]
+        return _SEQUENCE.unpack_from(self.shm.buf,self._offset(slot))[0] // 2
+
+    def get(self,host,port):
+        '''
+        :param: host - string server name as given to the publisher
+        :param: port - integer server port
+        :return: CollectedServer or None if nothing is published yet
+
+        Raises KeyError if the server has no slot.
+        '''
+        return self._read(self._slots[_key(host,port).decode('utf-8')])[1]
+
+    def snapshot(self):
+        '''
+        :return: dictionary of 'host:port' -> CollectedServer for every
+                 server with published results
+        '''
+        found = {}
+        for key,slot in self._slots.items():
+            server = self._read(slot)[1]
+            if server is not None:
+                found[key] = server
+        return found
+
+    def close(self):
+        '''
+        Detaches from the segment.
+        '''
+        self._cache.clear()
+        self.shm.close()
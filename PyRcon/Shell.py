@@ -0,0 +1,288 @@
+'''
+Command line front end for CoD4 remote consoles.
+
+With a single server and no script, an interactive shell is opened
+with command history and tab completion of command and dvar names.
+Given commands (-c) or a script (-f), the commands are run against
+every listed server in parallel and the output of each server is
+printed with the time each command took.
+
+  python -m PyRcon -p secret game1.example.com
+  python -m PyRcon -p secret -S fleet.txt -c 'say restarting in 5'
+
+Server files list one 'host[:port] [password]' per line, blank lines
+and lines starting with '#' are ignored.
+'''
+
+import argparse
+import os
+import sys
+from cmd import Cmd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import monotonic
+
+from .CoD4 import RemoteConsole
+from .Exceptions import NoResponseError, UsageError, ServerPasswordNotSet
+from .LatencyProfile import LatencyProfile
+from .MetadataCache import MetadataCache
+
+try:
+    import readline
+except ImportError:
+    readline = None
+
+_HISTORY = os.path.expanduser('~/.pyrcon_history')
+_DEFAULT_PORT = 28960
+
+
+def parse_address(text,port=_DEFAULT_PORT):
+    '''
+    :param: text - string 'host', 'host:port', '[v6addr]' or '[v6addr]:port'
+    :param: port - integer port used when text doesn't include one
+    :return: tuple (host,port)
+    '''
+    if text.startswith('['):
+        host,_,rest = text[1:].partition(']')
+        if rest.startswith(':'):
+            port = int(rest[1:])
+        return host,port
+    if text.count(':') == 1:
+        host,_,p = text.partition(':')
+        return host,int(p)
+    return text,port
+
+
+def read_servers(path,password=None,port=_DEFAULT_PORT):
+    '''
+    :param: path     - string filename of a servers file
+    :param: password - string used for entries without a password
+    :param: port     - integer used for entries without a port
+    :return: list of (host,port,password) tuples
+    '''
+    servers = []
+    with open(path) as fp:
+        for line in fp:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            host,p = parse_address(fields[0],port)
+            passwd = fields[1] if len(fields) > 1 else password
+            servers.append((host,p,passwd))
+    return servers
+
+
+def read_script(path):
+    '''
+    :param: path - string filename, '-' reads standard input
+    :return: list of command strings
+    '''
+    fp = sys.stdin if path == '-' else open(path)
+    try:
+        lines = [line.strip() for line in fp]
+    finally:
+        if fp is not sys.stdin:
+            fp.close()
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def run_commands(console,commands):
+    '''
+    :param: console  - RemoteConsole
+    :param: commands - list of command strings
+    :return: list of (command,result,seconds) tuples
+
+    Runs the commands in order against one console.  The result is
+    the server's reply, or the exception raised if the command failed.
+    '''
+    results = []
+    for command in commands:
+        start = monotonic()
+        try:
+            result = console.send(command)
+        except (NoResponseError,UsageError,ServerPasswordNotSet,
+                ValueError,OSError) as error:
+            result = error
+        results.append((command,result,monotonic() - start))
+    return results
+
+
+def run_fleet(consoles,commands,jobs=16):
+    '''
+    :param: consoles - list of RemoteConsoles
+    :param: commands - list of command strings
+    :param: jobs     - integer maximum number of servers worked at once
+    :return: generator of (console,results) tuples, see run_commands
+
+    Runs the commands against every console, each console in its own
+    worker thread.  Results are yielded as each console finishes.
+    '''
+    with ThreadPoolExecutor(max_workers=max(1,jobs)) as pool:
+        futures = {pool.submit(run_commands,c,commands):c for c in consoles}
+        for future in as_completed(futures):
+            yield futures[future],future.result()
+
+
+def format_results(console,results,width=22):
+    '''
+    :param: console - RemoteConsole
+    :param: results - list of (command,result,seconds) tuples
+    :param: width   - integer width of the server column
+    :return: string
+
+    One row per command with server, latency and the first line of
+    output; further output lines are indented beneath it.
+    '''
+    server = '%s:%s' % (console.host,console.port)
+    rows = []
+    for command,result,seconds in results:
+        if isinstance(result,Exception):
+            lines = ['ERROR %s%s' % (result.__class__.__name__,result.args)]
+        else:
+            lines = [line for line in result.split('\n') if line] or ['']
+        rows.append('%-*s %8.1fms  %s  %s' % (width,server,seconds * 1000,
+                                             command,lines[0]))
+        indent = ' ' * (width + 13)
+        rows.extend(indent + line for line in lines[1:])
+    return '\n'.join(rows)
+
+
+class RconShell(Cmd):
+    '''
+    Interactive remote console.  Anything typed is sent to the server
+    as-is, command and dvar names complete with TAB.
+    '''
+    intro = "Type 'quit' or ^D to leave."
+
+    def __init__(self,console,history=_HISTORY):
+        '''
+        :param: console - RemoteConsole
+        :param: history - string filename for readline history or None
+        '''
+        Cmd.__init__(self)
+        self.console = console
+        self.history = history
+        self.prompt = '%s:%s> ' % (console.host,console.port)
+        self._names = None
+
+    @property
+    def names(self):
+        '''
+        Sorted list of command and dvar names, fetched on first use.
+        '''
+        if self._names is None:
+            names = set()
+            for source in ('cmdlist','dvarlist'):
+                try:
+                    names.update(getattr(self.console,source))
+                except (NoResponseError,UsageError,ValueError,IndexError):
+                    pass
+            self._names = sorted(names)
+        return self._names
+
+    def preloop(self):
+        if readline is not None and self.history:
+            try:
+                readline.read_history_file(self.history)
+            except (IOError,OSError):
+                pass
+
+    def postloop(self):
+        if readline is not None and self.history:
+            try:
+                readline.write_history_file(self.history)
+            except (IOError,OSError):
+                pass
+
+    def emptyline(self):
+        pass
+
+    def default(self,line):
+        results = run_commands(self.console,[line])
+        for command,result,seconds in results:
+            if isinstance(result,Exception):
+                print('ERROR %s%s' % (result.__class__.__name__,result.args))
+            else:
+                print(result.rstrip('\n'))
+            print('(%.1f ms)' % (seconds * 1000))
+
+    def do_quit(self,arg):
+        '''Leave the shell.'''
+        return True
+
+    do_exit = do_quit
+
+    def do_EOF(self,arg):
+        print()
+        return True
+
+    def completenames(self,text,*ignored):
+        return [n for n in self.names if n.startswith(text)]
+
+    def completedefault(self,text,line,begidx,endidx):
+        return [n for n in self.names if n.startswith(text)]
+
+
+def main(argv=None):
+    '''
+    Entry point for 'python -m PyRcon'.
+    '''
+    parser = argparse.ArgumentParser(prog='pyrcon',
+                                     description='CoD4 remote console')
+    parser.add_argument('servers',nargs='*',metavar='HOST[:PORT]')
+    parser.add_argument('-p','--password',
+                        default=os.environ.get('PYRCON_PASSWORD'),
+                        help='rcon password, default $PYRCON_PASSWORD')
+    parser.add_argument('-P','--port',type=int,default=_DEFAULT_PORT)
+    parser.add_argument('-S','--servers-file',action='append',default=[],
+                        help="file of 'host[:port] [password]' lines")
+    parser.add_argument('-c','--command',action='append',default=[],
+                        help='command to run, may be repeated')
+    parser.add_argument('-f','--script',
+                        help="file of commands to run, '-' for stdin")
+    parser.add_argument('-j','--jobs',type=int,default=16,
+                        help='servers worked in parallel')
+    parser.add_argument('--profile',
+                        help='file to load/save the latency profile')
+    parser.add_argument('--cache-dir',
+                        help='metadata cache directory, default ~/.cache/pyrcon')
+    parser.add_argument('--no-cache',action='store_true',
+                        help='always fetch cmdlist/dvarlist from the server')
+    args = parser.parse_args(argv)
+
+    servers = [parse_address(s,args.port) + (args.password,)
+               for s in args.servers]
+    for path in args.servers_file:
+        servers.extend(read_servers(path,args.password,args.port))
+    if not servers:
+        parser.error('no servers given')
+    for host,port,passwd in servers:
+        if not passwd:
+            parser.error('no rcon password for %s:%s, use -p or $PYRCON_PASSWORD'
+                         % (host,port))
+
+    profile = LatencyProfile(args.profile)
+    metadata = None if args.no_cache else MetadataCache(args.cache_dir)
+    consoles = [RemoteConsole(passwd,host,port,profile=profile,
+                              metadata=metadata)
+                for host,port,passwd in servers]
+
+    commands = list(args.command)
+    if args.script:
+        commands.extend(read_script(args.script))
+
+    status = 0
+    try:
+        if commands:
+            width = max(len('%s:%s' % (c.host,c.port)) for c in consoles)
+            for console,results in run_fleet(consoles,commands,args.jobs):
+                print(format_results(console,results,width))
+                if any(isinstance(r,Exception) for _,r,_ in results):
+                    status = 1
+        elif len(consoles) == 1:
+            RconShell(consoles[0]).cmdloop()
+        else:
+            parser.error('the interactive shell takes a single server')
+    finally:
+        if args.profile:
+            profile.save()
+    return status
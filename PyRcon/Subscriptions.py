@@ -0,0 +1,241 @@
+'''
+Dvar change subscriptions.
+
+Callers subscribe to dvar names ('sv_hostname') or prefixes ending in
+'*' ('scr_*') and are called back with (name,old,new) only when a
+value changes.  Every console has one DvarSubscriptions, shared by all
+of its subscribers, which turns their patterns into as few dvardump
+queries as it can: patterns covered by a shorter prefix are dropped,
+and if more than max_queries prefixes remain the closest ones are
+merged into their common prefix, as long as they have one.
+
+Each query is polled on its own schedule.  A query whose dvars did
+not change backs its interval off towards max_interval; a change
+resets it to the base interval.  Polls go through the console itself,
+which serializes them with the caller's own commands.
+
+  def renamed(name,old,new):
+      print(name,old,'->',new)
+
+  console.subscriptions.subscribe('sv_hostname',renamed)
+  console.subscriptions.start()
+'''
+
+from threading import Event, Lock, Thread
+from time import monotonic
+
+from .Exceptions import NoResponseError, UsageError
+
+
+class Subscription(object):
+    '''
+    One subscriber's interest in a dvar name or prefix.
+    '''
+    __slots__ = ('pattern','prefix','exact','callback')
+
+    def __init__(self,pattern,callback):
+        '''
+        :param: pattern  - string dvar name, or prefix ending in '*'
+        :param: callback - callable(name,old,new)
+        '''
+        self.pattern = pattern
+        self.exact = not pattern.endswith('*')
+        self.prefix = pattern.rstrip('*')
+        self.callback = callback
+
+    def __repr__(self):
+        return '<%s(%s)>' % (self.__class__.__name__,self.pattern)
+
+    def matches(self,name):
+        if self.exact:
+            return name == self.prefix
+        return name.startswith(self.prefix)
+
+
+class _Query(object):
+    __slots__ = ('prefix','interval','due')
+
+    def __init__(self,prefix,interval):
+        self.prefix = prefix
+        self.interval = interval
+        self.due = 0.0
+
+
+def coalesce(prefixes,max_queries):
+    '''
+    :param: prefixes    - iterable of string dvar name prefixes
+    :param: max_queries - integer upper bound on prefixes returned
+    :return: sorted list of prefixes covering every input prefix
+
+    Drops prefixes that extend another one, then repeatedly merges the
+    adjacent pair sharing the longest common prefix until at most
+    max_queries remain.  Pairs with nothing in common are never merged,
+    as the empty prefix would dump every dvar, so more than max_queries
+    prefixes are returned when only such pairs are left.
+    '''
+    result = []
+    for prefix in sorted(set(prefixes)):
+        if result and prefix.startswith(result[-1]):
+            continue
+        result.append(prefix)
+
+    while len(result) > max(1,max_queries):
+        best,common = None,''
+        for i in range(len(result) - 1):
+            a,b = result[i],result[i + 1]
+            n = 0
+            while n < min(len(a),len(b)) and a[n] == b[n]:
+                n += 1
+            if n > len(common):
+                best,common = i,a[:n]
+        if best is None:
+            break
+        result[best:best + 2] = [common]
+        merged = []
+        for prefix in result:
+            if merged and prefix.startswith(merged[-1]):
+                continue
+            merged.append(prefix)
+        result = merged
+    return result
+
+
+class DvarSubscriptions(object):
+    '''
+    Coalesced, backed-off dvardump polling for a console's subscribers.
+    '''
+
+    def __init__(self,console,interval=5.0,max_interval=120.0,backoff=2.0,
+                 max_queries=4):
+        '''
+        :param: console      - RemoteConsole
+        :param: interval     - float base seconds between polls of a query
+        :param: max_interval - float longest a quiet query is left unpolled
+        :param: backoff      - float factor a quiet query's interval grows by
+        :param: max_queries  - integer most dvardump queries per cycle
+        '''
+        self.console = console
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_queries = max_queries
+        self._lock = Lock()
+        self._subscriptions = []
+        self._queries = []
+        self._values = {}
+        self._stop = Event()
+        self._thread = None
+
+    def __repr__(self):
+        return '<%s(%d subscriptions,%d queries)>' % (self.__class__.__name__,
+                                                      len(self._subscriptions),
+                                                      len(self._queries))
+
+    @property
+    def queries(self):
+        '''
+        List of the dvardump prefixes currently polled.
+        '''
+        with self._lock:
+            return [q.prefix for q in self._queries]
+
+    def _plan(self):
+        old = {q.prefix:q for q in self._queries}
+        prefixes = coalesce([s.prefix for s in self._subscriptions],
+                            self.max_queries) if self._subscriptions else []
+        self._queries = [old.get(p) or _Query(p,self.interval) for p in prefixes]
+
+    def subscribe(self,pattern,callback):
+        '''
+        :param: pattern  - string dvar name, or prefix ending in '*'
+        :param: callback - callable(name,old,new)
+        :return: Subscription, pass to unsubscribe()
+        '''
+        subscription = Subscription(pattern,callback)
+        with self._lock:
+            self._subscriptions.append(subscription)
+            self._plan()
+        return subscription
+
+    def unsubscribe(self,subscription):
+        '''
+        :param: subscription - Subscription returned by subscribe()
+        '''
+        with self._lock:
+            try:
+                self._subscriptions.remove(subscription)
+            except ValueError:
+                return
+            self._plan()
+
+    def poll(self,force=False):
+        '''
+        :param: force - bool, run every query whether it is due or not
+        :return: list of (name,old,new) changes seen
+
+        Runs the queries that are due and calls back subscribers of any
+        dvar whose value changed.  The first value seen for a dvar is
+        only remembered.
+        '''
+        now = monotonic()
+        with self._lock:
+            due = [q for q in self._queries if force or q.due <= now]
+
+        changes = []
+        for query in due:
+            try:
+                dvars = self.console.dvardump(query.prefix)
+            except (NoResponseError,UsageError,ValueError,IndexError):
+                query.due = monotonic() + query.interval
+                continue
+
+            with self._lock:
+                subscribed = [s for s in self._subscriptions
+                              if s.prefix.startswith(query.prefix)]
+                found = []
+                for name,value in dvars.items():
+                    watchers = [s for s in subscribed if s.matches(name)]
+                    if not watchers:
+                        continue
+                    old = self._values.get(name)
+                    self._values[name] = value
+                    if old is not None and old != value:
+                        found.append((name,old,value,watchers))
+
+                if found:
+                    query.interval = self.interval
+                else:
+                    query.interval = min(query.interval * self.backoff,
+                                         self.max_interval)
+                query.due = monotonic() + query.interval
+
+            for name,old,value,watchers in found:
+                changes.append((name,old,value))
+                for subscription in watchers:
+                    subscription.callback(name,old,value)
+        return changes
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll()
+            with self._lock:
+                due = [q.due for q in self._queries]
+            wait = min(due) - monotonic() if due else self.interval
+            self._stop.wait(min(max(0.05,wait),self.interval))
+
+    def start(self):
+        '''
+        Starts polling in a background thread.
+        '''
+        self._stop.clear()
+        self._thread = Thread(target=self._run,daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stops the polling thread.
+        '''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -5,5 +5,5 @@ except:
     from pkgutil import extend_path
     __path__ = extend_path(__path__, __name__)
 
-__all__ = ['QuakeRemoteConsole','CoD4']
+__all__ = ['QuakeRemoteConsole','CoD4','LatencyProfile','MetadataCache','Shell','Exporter','Fleet','Moderation','History','Capture','Health','Subscriptions','Collector','SharedState','Analytics','LoadTest']
 
@@ -0,0 +1,5 @@
+
+import sys
+from .Shell import main
+
+sys.exit(main())
@@ -0,0 +1,82 @@
+'''
+A local CoD4-like server for tests: answers getinfo and rcon commands
+from a dictionary of dvars, splitting replies over several datagrams.
+'''
+
+from select import select
+from socket import socket, AF_INET, SOCK_DGRAM
+from threading import Event, Thread
+
+_OOB = b'\xff\xff\xff\xff'
+_PRINT = _OOB + b'print\n'
+_INFO = _OOB + b'infoResponse\n'
+
+STATUS = '''map: mp_crash
+num score ping guid                             name            lastmsg address               qport rate
+--- ----- ---- -------------------------------- --------------- ------- --------------------- ----- -----
+  0    10   50 0123456789abcdef0123456789abcdef ^1Alice^7            0 10.0.0.1:28960        1234 25000
+  1     5  120 fedcba9876543210fedcba9876543210 Bob                  0 10.0.0.2:28960        4321 25000
+'''
+
+
+class FakeServer(object):
+
+    def __init__(self,chunk=64):
+        self.chunk = chunk
+        self.dvars = {'mapname':'mp_crash','g_gametype':'war',
+                      'sv_hostname':'Fake','sv_serverid':'1'}
+        self.commands = []
+        self.status = STATUS
+        self.sock = socket(AF_INET,SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1',0))
+        self.port = self.sock.getsockname()[1]
+        self._stop = Event()
+        self._thread = Thread(target=self._serve,daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self,*exc):
+        self._stop.set()
+        self._thread.join()
+        self.sock.close()
+
+    def _reply(self,address,text):
+        data = text.encode('utf-8')
+        for i in range(0,max(1,len(data)),self.chunk):
+            self.sock.sendto(_PRINT + data[i:i + self.chunk],address)
+
+    def _dvardump(self,prefix):
+        found = sorted((k,v) for k,v in self.dvars.items() if k.startswith(prefix))
+        lines = ['=' * 35]
+        lines.extend('%s "%s"' % kv for kv in found)
+        lines.append('=' * 35)
+        lines.append('%d total dvars' % (len(found)))
+        lines.append('%d dvar indexes' % (len(found)))
+        return '\n'.join(lines) + '\n'
+
+    def _serve(self):
+        while not self._stop.is_set():
+            ready,_,_ = select([self.sock],[],[],0.05)
+            if not ready:
+                continue
+            data,address = self.sock.recvfrom(4096)
+            if data.startswith(_OOB + b'getinfo'):
+                info = '\\mapname\\%s\\gametype\\%s' % (self.dvars['mapname'],
+                                                        self.dvars['g_gametype'])
+                self.sock.sendto(_INFO + info.encode('utf-8'),address)
+                continue
+            text = data.split(b'rcon ',1)[1].decode('utf-8').partition(' ')[2]
+            self.commands.append(text)
+            verb,_,args = text.strip().partition(' ')
+            if verb == 'status':
+                self._reply(address,self.status)
+            elif verb == 'dvardump':
+                self._reply(address,self._dvardump(args.strip()))
+            elif verb == 'set':
+                name,_,value = args.partition(' ')
+                self.dvars[name] = value.strip('"')
+                self._reply(address,'')
+            else:
+                self._reply(address,'%s\n' % (text))
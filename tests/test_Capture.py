@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+from time import monotonic
+
+from PyRcon.Capture import CaptureLog, ReplayTransport, read_capture, redact
+from PyRcon.CoD4 import RemoteConsole
+
+from fakeserver import FakeServer
+
+QUAKE = b'\xff\xff\xff\xffrcon secret status'
+COD = b'\xff\xff\xff\xff\x02rcon secret dvardump sv_'
+
+
+class RedactTest(unittest.TestCase):
+
+    def test_quake_prefix(self):
+        self.assertEqual(redact(QUAKE),b'\xff\xff\xff\xffrcon ******** status')
+
+    def test_cod_prefix(self):
+        self.assertEqual(redact(COD),b'\xff\xff\xff\xff\x02rcon ******** dvardump sv_')
+
+    def test_password_only(self):
+        self.assertEqual(redact(b'\xff\xff\xff\xffrcon secret'),
+                         b'\xff\xff\xff\xffrcon ********')
+
+    def test_other_datagrams_unchanged(self):
+        for data in (b'\xff\xff\xff\xffgetinfo PyRcon',
+                     b'\xff\xff\xff\xffprint\nrcon secret x',
+                     b'rcon secret status'):
+            self.assertEqual(redact(data),data)
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        fd,self.path = tempfile.mkstemp()
+        os.close(fd)
+        with FakeServer() as server:
+            console = RemoteConsole('secret','127.0.0.1',server.port)
+            console.capture = CaptureLog(self.path)
+            self.players = console.players
+            self.dvars = console.dvardump('sv_')
+            console.capture.close()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def console(self,transport,password='other'):
+        console = RemoteConsole(password,'127.0.0.1',1)
+        console.transport = transport
+        return console
+
+    def test_password_not_captured(self):
+        with open(self.path,'rb') as fp:
+            self.assertNotIn(b'secret',fp.read())
+        requests = [r[2] for r in read_capture(self.path) if r[1] == CaptureLog.OUT]
+        self.assertEqual(len(requests),2)
+        self.assertTrue(all(b'********' in r for r in requests))
+
+    def test_replay_without_delay(self):
+        transport = ReplayTransport(self.path,speed=None)
+        console = self.console(transport)
+        start = monotonic()
+        self.assertEqual(console.players,self.players)
+        self.assertEqual(console.dvardump('sv_'),self.dvars)
+        self.assertEqual(transport.remaining,0)
+        self.assertLess(monotonic() - start,2.0)
+
+    def test_strict_replay_rejects_other_requests(self):
+        console = self.console(ReplayTransport(self.path,speed=None))
+        self.assertRaises(ValueError,console.dvardump,'sv_')
+
+    def test_loose_replay_answers_other_requests(self):
+        transport = ReplayTransport(self.path,speed=None,strict=False)
+        console = self.console(transport)
+        console.send('status')
+        self.assertEqual(transport.remaining,1)
+
+    def test_exhausted_capture(self):
+        console = self.console(ReplayTransport(self.path,speed=None))
+        console.players
+        console.dvardump('sv_')
+        self.assertRaises(ValueError,console.send,'status')
+
+    def test_not_a_capture(self):
+        with open(self.path,'wb') as fp:
+            fp.write(b'something else')
+        self.assertRaises(ValueError,ReplayTransport,self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+from PyRcon.CoD4 import RemoteConsole
+from PyRcon.Fleet import RollingOperation
+
+from fakeserver import FakeServer
+
+
+class UnchangedActionTest(unittest.TestCase):
+
+    def run_action(self,action,args=()):
+        with FakeServer() as server:
+            console = RemoteConsole('secret','127.0.0.1',server.port)
+            op = RollingOperation([console],action,args,ready_timeout=2.0,
+                                  player_timeout=2.0)
+            result = op.run()[0]
+            self.assertTrue(result.ok,result.error)
+            self.assertLess(result.elapsed,2.0)
+            self.assertEqual(result.players_after,2)
+            return server
+
+    def test_execute_needs_no_serverid_change(self):
+        server = self.run_action('execute',('server.cfg',))
+        self.assertIn('exec server.cfg',server.commands)
+
+    def test_net_restart_needs_no_serverid_change(self):
+        server = self.run_action('net_restart')
+        self.assertIn('net_restart',server.commands)
+
+
+if __name__ == '__main__':
+    unittest.main()
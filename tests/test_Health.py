@@ -0,0 +1,54 @@
+import unittest
+from threading import Event, Thread
+
+from PyRcon.CoD4 import RemoteConsole
+from PyRcon.Health import CircuitBreaker, HealthProber
+
+from fakeserver import FakeServer
+
+
+class ProbeWhileSendingTest(unittest.TestCase):
+
+    def test_probes_and_commands_share_a_console(self):
+        with FakeServer() as server:
+            console = RemoteConsole('secret','127.0.0.1',server.port)
+            prober = HealthProber([console],timeout=0.5)
+            stop = Event()
+            probes = []
+
+            def probe():
+                while not stop.is_set():
+                    probes.append(prober.probe(console))
+            thread = Thread(target=probe,daemon=True)
+            thread.start()
+            try:
+                for _ in range(200):
+                    reply = console.send('status',timeout=0.02,retries=0)
+                    self.assertTrue(reply.startswith('map: mp_crash'))
+            finally:
+                stop.set()
+                thread.join()
+
+            self.assertTrue(probes)
+            score = prober.scores()['127.0.0.1:%d' % (server.port)]
+            self.assertEqual(score.failures,0)
+            self.assertEqual(score.loss,0.0)
+            self.assertEqual(console.breaker.state,CircuitBreaker.CLOSED)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_opens_after_threshold_and_half_opens(self):
+        breaker = CircuitBreaker(threshold=2,reset_timeout=0.0)
+        breaker.failure()
+        self.assertEqual(breaker.state,CircuitBreaker.CLOSED)
+        breaker.failure()
+        self.assertEqual(breaker.state,CircuitBreaker.OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state,CircuitBreaker.HALF_OPEN)
+        breaker.success()
+        self.assertEqual(breaker.state,CircuitBreaker.CLOSED)
+
+
+if __name__ == '__main__':
+    unittest.main()
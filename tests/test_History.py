@@ -0,0 +1,75 @@
+import unittest
+
+from PyRcon.History import StatusHistory
+
+
+def table(*rows):
+    return {name:{'ping':str(ping),'score':str(score)} for name,ping,score in rows}
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def test_oldest_rows_are_overwritten(self):
+        history = StatusHistory(capacity=4,samples=2)
+        for t in range(6):
+            history.record(table(('p%d' % t,50,t)),when=float(t))
+        self.assertEqual(len(history),4)
+        self.assertEqual([r[0] for r in history.rows(window=100)],[2.0,3.0,4.0,5.0])
+        self.assertEqual(history.player_count(window=100),[(4.0,1),(5.0,1)])
+
+    def test_names_are_released_once_overwritten(self):
+        history = StatusHistory(capacity=4)
+        history.record(table(('alice',50,0),('bob',60,0)),when=0.0)
+        history.record(table(('alice',50,1),('carol',70,0)),when=1.0)
+        history.record(table(('dave',80,0),('erin',90,0)),when=2.0)
+        self.assertEqual(set(history._ids),{'alice','carol','dave','erin'})
+        history.record(table(('frank',40,0),('grace',30,0)),when=3.0)
+        self.assertEqual(set(history._ids),{'dave','erin','frank','grace'})
+        self.assertEqual(len(history._free),0)
+        for t in range(4,40):
+            history.record(table(('p%d' % t,50,0)),when=float(t))
+        self.assertLessEqual(len(history._ids),history.capacity)
+
+    def test_unparsable_rows(self):
+        history = StatusHistory(capacity=8)
+        history.record({'a':{'ping':'CNCT','score':'3'},
+                        'b':{'ping':'50','score':'x'}},when=0.0)
+        self.assertEqual(history.rows(),[(0.0,'a',-1,3)])
+        self.assertEqual(history.player_count(),[(0.0,2)])
+
+
+class WindowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.history = StatusHistory(capacity=64,window=60.0)
+        self.history.record(table(('alice',100,0),('bob',40,10)),when=0.0)
+        self.history.record(table(('alice',50,5),('bob',60,2)),when=60.0)
+        self.history.record(table(('alice',0,20)),when=120.0)
+
+    def test_window_is_relative_to_newest_sample(self):
+        self.assertEqual(self.history.players(),{'alice','bob'})
+        self.assertEqual(self.history.players(window=0),{'alice'})
+        self.assertEqual(self.history.players(window=1000),{'alice','bob'})
+        self.assertEqual([r[0] for r in self.history.rows()],[60.0,60.0,120.0])
+
+    def test_average_ping(self):
+        self.assertEqual(self.history.average_ping(window=1000),
+                         {'alice':50.0,'bob':50.0})
+
+    def test_score_rate_counts_increases_only(self):
+        rates = self.history.score_rate(window=1000)
+        self.assertEqual(rates,{'alice':10.0,'bob':0.0})
+        self.assertEqual(self.history.score_rate(),{'alice':15.0})
+
+    def test_player_count(self):
+        self.assertEqual(self.history.player_count(),[(60.0,2),(120.0,1)])
+
+    def test_empty(self):
+        history = StatusHistory()
+        self.assertEqual(history.rows(),[])
+        self.assertEqual(history.player_count(),[])
+        self.assertEqual(history.average_ping(),{})
+
+
+if __name__ == '__main__':
+    unittest.main()
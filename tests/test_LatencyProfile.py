@@ -0,0 +1,139 @@
+import unittest
+
+from PyRcon.CoD4 import RemoteConsole
+from PyRcon.LatencyProfile import LatencyProfile
+
+ADDRESS = ('game1',28960)
+
+
+def budget(timeout_retries):
+    timeout,retries = timeout_retries
+    return timeout * (retries + 1)
+
+
+def profiled(first,gap=0.0,samples=5,verb='status'):
+    profile = LatencyProfile()
+    for _ in range(samples):
+        profile.sent(ADDRESS,verb)
+        profile.record(ADDRESS,verb,first,gap)
+    return profile
+
+
+class TimeoutForTest(unittest.TestCase):
+
+    def test_unprofiled_returns_default(self):
+        profile = LatencyProfile()
+        self.assertEqual(profile.timeout_for(ADDRESS,'status',(0.05,2)),(0.05,2))
+
+    def test_too_few_samples_returns_default(self):
+        profile = profiled(0.001,samples=LatencyProfile._MIN_SAMPLES - 1)
+        self.assertEqual(profile.timeout_for(ADDRESS,'status',(0.05,2)),(0.05,2))
+
+    def test_fast_server_gets_a_shorter_budget(self):
+        profile = profiled(0.002,gap=0.001)
+        est = profile.estimate(ADDRESS,'status')
+        timeout,retries = profile.timeout_for(ADDRESS,'status',(0.05,2))
+        self.assertEqual(timeout,LatencyProfile._MIN_TIMEOUT)
+        self.assertLess(budget((timeout,retries)),0.15)
+        self.assertGreaterEqual(budget((timeout,retries)),
+                                est.rto + LatencyProfile._SERVER_FRAME)
+
+    def test_budget_has_an_absolute_minimum(self):
+        profile = profiled(0.0001)
+        self.assertGreaterEqual(budget(profile.timeout_for(ADDRESS,'status',(0.05,2))),
+                                LatencyProfile._MIN_BUDGET)
+
+    def test_gaps_lengthen_the_budget(self):
+        quiet = profiled(0.01,gap=0.0)
+        gappy = profiled(0.01,gap=0.05)
+        self.assertGreater(budget(gappy.timeout_for(ADDRESS,'status',(0.05,2))),
+                           budget(quiet.timeout_for(ADDRESS,'status',(0.05,2))))
+
+    def test_slow_server_covers_rtt_plus_a_frame(self):
+        profile = profiled(0.3,gap=0.04)
+        est = profile.estimate(ADDRESS,'status')
+        timeout,retries = profile.timeout_for(ADDRESS,'status',(0.05,2))
+        self.assertAlmostEqual(timeout,0.08)
+        self.assertGreaterEqual(budget((timeout,retries)),
+                                est.rto + LatencyProfile._SERVER_FRAME)
+
+    def test_unprofiled_verb_is_stretched_by_server_estimate(self):
+        profile = profiled(0.5,verb='status')
+        est = profile.estimate(ADDRESS)
+        timeout,retries = profile.timeout_for(ADDRESS,'dvardump',(0.05,2))
+        self.assertEqual(timeout,0.05)
+        self.assertGreaterEqual(budget((timeout,retries)),
+                                est.rto + LatencyProfile._SERVER_FRAME)
+
+    def test_unprofiled_verb_keeps_default_on_fast_server(self):
+        profile = profiled(0.002,verb='status')
+        self.assertEqual(profile.timeout_for(ADDRESS,'dvardump',(0.05,2)),(0.05,2))
+
+    def test_verb_estimate_preferred_over_server_estimate(self):
+        profile = profiled(0.5,verb='dvardump')
+        for _ in range(5):
+            profile.record(ADDRESS,'status',0.002,0.001)
+        fast = profile.timeout_for(ADDRESS,'status',(0.05,2))
+        slow = profile.timeout_for(ADDRESS,'dvardump',(0.05,2))
+        self.assertLess(budget(fast),budget(slow))
+
+    def test_retries_are_capped(self):
+        profile = profiled(30.0)
+        timeout,retries = profile.timeout_for(ADDRESS,'status',(0.05,2))
+        self.assertEqual(retries,LatencyProfile._MAX_RETRIES)
+        self.assertLessEqual(timeout,LatencyProfile._MAX_TIMEOUT)
+
+    def test_timeouts_back_off(self):
+        profile = profiled(0.1)
+        before = budget(profile.timeout_for(ADDRESS,'status',(0.05,2)))
+        profile.record_timeout(ADDRESS,'status')
+        after = budget(profile.timeout_for(ADDRESS,'status',(0.05,2)))
+        self.assertGreater(after,before)
+
+
+class ConsoleTimeoutTest(unittest.TestCase):
+
+    def console(self,profile=None):
+        console = RemoteConsole('secret','game1',28960,profile=profile)
+        console.calls = []
+
+        def transact(data,header,verb,message,timeout,retries,single=False):
+            console.calls.append((verb,timeout,retries))
+            return [b'']
+        console._transact = transact
+        return console
+
+    def test_class_default(self):
+        console = self.console()
+        self.assertEqual(console.timeout_for('status'),
+                         (RemoteConsole._TIMEOUT,RemoteConsole._RETRIES))
+
+    def test_per_verb_default_overrides_class_default(self):
+        console = self.console()
+        self.assertEqual(console.timeout_for('map mp_crash'),
+                         RemoteConsole._TIMEOUTS['map'])
+
+    def test_profiled_fast_map_is_shorter_than_default(self):
+        console = self.console(profiled(0.002,gap=0.002,verb='map'))
+        self.assertLess(budget(console.timeout_for('map mp_crash')),
+                        budget(RemoteConsole._TIMEOUTS['map']))
+
+    def test_unprofiled_map_keeps_per_verb_default(self):
+        console = self.console(profiled(0.002,verb='status'))
+        self.assertEqual(console.timeout_for('map mp_crash'),
+                         RemoteConsole._TIMEOUTS['map'])
+
+    def test_caller_arguments_override_profile(self):
+        console = self.console(profiled(0.3,verb='status'))
+        console.send('status',timeout=0.01,retries=0)
+        self.assertEqual(console.calls[-1],('status',0.01,0))
+
+    def test_missing_arguments_come_from_profile(self):
+        console = self.console(profiled(0.3,verb='status'))
+        console.send('status',timeout=0.01)
+        expected = console.timeout_for('status')[1]
+        self.assertEqual(console.calls[-1],('status',0.01,expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
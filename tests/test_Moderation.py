@@ -0,0 +1,156 @@
+import os
+import tempfile
+import unittest
+from time import monotonic
+
+from PyRcon.Exceptions import NoResponseError, PlayerNotFound
+from PyRcon.Moderation import BanIndex, Moderator, RateLimiter, clean_name
+
+GUID = '0123456789abcdef0123456789abcdef'
+
+
+def player(num,name,guid='0',address='10.0.0.1:28960'):
+    return {'num':str(num),'name':name,'guid':guid,'address':address}
+
+
+class BanIndexTest(unittest.TestCase):
+
+    def test_clean_name(self):
+        self.assertEqual(clean_name('^1Bad^7 "Guy"'),'bad guy')
+
+    def test_match_by_guid_ip_and_name(self):
+        for bloom in (False,True):
+            index = BanIndex(bloom=bloom,capacity=100)
+            index.add(guid=GUID.upper(),reason='aimbot')
+            index.add(ip='10.0.0.9',action='tempban')
+            index.add(name='^1Bad Guy',action='kick')
+            self.assertEqual(index.match(player(0,'x',guid=GUID)).reason,'aimbot')
+            self.assertEqual(index.match(player(1,'x',address='10.0.0.9:28960')).action,
+                             'tempban')
+            self.assertEqual(index.match(player(2,'^2bad guy^7')).action,'kick')
+            self.assertIsNone(index.match(player(3,'Good Guy')))
+
+    def test_remove_and_rebuild(self):
+        index = BanIndex(bloom=True,capacity=100)
+        index.add(name='Bad Guy')
+        index.remove(name='Bad Guy')
+        self.assertIsNone(index.match(player(0,'Bad Guy')))
+        index.rebuild()
+        self.assertIsNone(index.match(player(0,'Bad Guy')))
+        self.assertEqual(len(index),0)
+
+    def test_unknown_action_is_rejected(self):
+        self.assertRaises(ValueError,BanIndex().add,name='x',action='mute')
+
+    def test_save_and_load_round_trip(self):
+        index = BanIndex()
+        index.add(guid=GUID,reason='aimbot\twallhack')
+        index.add(ip='10.0.0.9',action='tempban')
+        index.add(name='Bad Guy',action='kick',reason='spam, twice')
+        fd,path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            index.save(path)
+            loaded = BanIndex()
+            loaded.load(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(len(loaded),3)
+        entry = loaded.match(player(0,'bad guy'))
+        self.assertEqual((entry.key,entry.action,entry.reason),
+                         ('name:bad guy','kick','spam, twice'))
+        self.assertEqual(loaded.match(player(1,'x',guid=GUID)).reason,
+                         'aimbot wallhack')
+        self.assertEqual(loaded.match(player(2,'x',address='10.0.0.9:1')).action,
+                         'tempban')
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        limiter = RateLimiter(rate=50.0,burst=3)
+        start = monotonic()
+        for _ in range(3):
+            limiter.acquire()
+        self.assertLess(monotonic() - start,0.02)
+        for _ in range(5):
+            limiter.acquire()
+        self.assertGreaterEqual(monotonic() - start,5 / 50.0 - 0.01)
+
+
+class StubConsole(object):
+    host = '127.0.0.1'
+    port = 28960
+
+    def __init__(self,players):
+        self.table = players
+        self.sent = []
+
+    @property
+    def players(self):
+        self.sent.append('status')
+        if self.table is None:
+            raise NoResponseError('status',0.05,2)
+        return self.table
+
+    def kick(self,number):
+        self.sent.append('kick %s' % (number))
+
+    def ban(self,number,temporary=True):
+        self.sent.append('%s %s' % ('tempban' if temporary else 'ban',number))
+
+
+class CountingLimiter(object):
+
+    def __init__(self):
+        self.tokens = 0
+
+    def acquire(self):
+        self.tokens += 1
+
+
+class ModeratorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = BanIndex()
+        self.index.add(guid=GUID,reason='aimbot')
+        self.index.add(name='Bad Guy',action='kick')
+        self.index.add(name='Worse Guy',action='tempban')
+        self.moderator = Moderator(self.index)
+        self.limiter = CountingLimiter()
+        self.moderator._limiters[('127.0.0.1',28960)] = self.limiter
+
+    def test_one_status_per_batch_and_a_token_per_command(self):
+        table = {'Cheat':player(0,'Cheat',guid=GUID),
+                 'Bad Guy':player(1,'Bad Guy'),
+                 'Worse Guy':player(2,'Worse Guy'),
+                 'Fine':player(3,'Fine')}
+        console = StubConsole(table)
+        results = self.moderator.sweep([console])
+        self.assertEqual(console.sent,['status','status','ban 0','kick 1','tempban 2'])
+        self.assertEqual(self.limiter.tokens,len(console.sent))
+        self.assertEqual([r[3] for r in results],[None,None,None])
+
+    def test_slot_taken_over_is_left_alone(self):
+        console = StubConsole({'Bad Guy':player(1,'Bad Guy')})
+        matches = self.moderator.scan([(console,console.table)])
+        console.table = {'Newcomer':player(1,'Newcomer')}
+        results = self.moderator.enforce(matches)
+        self.assertEqual(console.sent,['status'])
+        self.assertIsInstance(results[0][3],PlayerNotFound)
+        self.assertEqual(self.limiter.tokens,1)
+
+    def test_failed_confirmation_fails_the_batch(self):
+        console = StubConsole({'Bad Guy':player(1,'Bad Guy'),
+                               'Worse Guy':player(2,'Worse Guy')})
+        matches = self.moderator.scan([(console,console.table)])
+        console.table = None
+        results = self.moderator.enforce(matches)
+        self.assertEqual(len(results),2)
+        for result in results:
+            self.assertIsInstance(result[3],NoResponseError)
+        self.assertEqual(console.sent,['status'])
+
+
+if __name__ == '__main__':
+    unittest.main()
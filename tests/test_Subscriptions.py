@@ -0,0 +1,133 @@
+import unittest
+from time import monotonic, sleep
+
+from PyRcon.CoD4 import RemoteConsole
+from PyRcon.Exceptions import NoResponseError
+from PyRcon.Subscriptions import DvarSubscriptions, coalesce
+
+from fakeserver import FakeServer
+
+
+class CoalesceTest(unittest.TestCase):
+
+    def test_prefixes_extending_another_are_dropped(self):
+        self.assertEqual(coalesce(['scr_','scr_dm_','scr_war_timelimit'],4),
+                         ['scr_'])
+
+    def test_within_limit_kept_sorted(self):
+        self.assertEqual(coalesce(['sv_hostname','g_gametype'],4),
+                         ['g_gametype','sv_hostname'])
+
+    def test_closest_pair_is_merged(self):
+        self.assertEqual(coalesce(['scr_dm_a','scr_dm_b','scr_war_a'],2),
+                         ['scr_dm_','scr_war_a'])
+
+    def test_never_merges_to_the_empty_prefix(self):
+        result = coalesce(['sv_hostname','g_gametype','scr_a','scr_b','ui_x'],2)
+        self.assertNotIn('',result)
+        for prefix in ['sv_hostname','g_gametype','scr_a','scr_b','ui_x']:
+            self.assertTrue(any(prefix.startswith(p) for p in result))
+
+    def test_unrelated_prefixes_exceed_the_limit(self):
+        self.assertEqual(coalesce(['a','b','c'],1),['a','b','c'])
+
+    def test_subscribing_to_everything_is_kept(self):
+        self.assertEqual(coalesce(['','sv_hostname'],1),[''])
+
+
+class StubConsole(object):
+
+    def __init__(self,dvars):
+        self.dvars = dvars
+        self.queries = []
+
+    def dvardump(self,prefix=''):
+        self.queries.append(prefix)
+        if self.dvars is None:
+            raise NoResponseError('dvardump',0.05,2)
+        return {k:v for k,v in self.dvars.items() if k.startswith(prefix)}
+
+
+class PollTest(unittest.TestCase):
+
+    def setUp(self):
+        self.console = StubConsole({'sv_hostname':'Fake','scr_dm_scorelimit':'150',
+                                    'scr_war_timelimit':'10'})
+        self.subscriptions = DvarSubscriptions(self.console,interval=1.0,
+                                               max_interval=8.0)
+        self.seen = []
+        self.callback = lambda *change: self.seen.append(change)
+
+    def test_first_value_is_only_remembered(self):
+        self.subscriptions.subscribe('sv_hostname',self.callback)
+        self.assertEqual(self.subscriptions.poll(force=True),[])
+        self.assertEqual(self.seen,[])
+
+    def test_change_calls_back_matching_subscribers(self):
+        self.subscriptions.subscribe('scr_*',self.callback)
+        self.subscriptions.subscribe('sv_hostname',self.callback)
+        self.subscriptions.poll(force=True)
+        self.console.dvars['scr_dm_scorelimit'] = '200'
+        self.console.dvars['sv_hostname'] = 'Renamed'
+        changes = self.subscriptions.poll(force=True)
+        self.assertEqual(sorted(changes),
+                         [('scr_dm_scorelimit','150','200'),
+                          ('sv_hostname','Fake','Renamed')])
+        self.assertEqual(sorted(self.seen),sorted(changes))
+
+    def test_exact_subscription_ignores_longer_names(self):
+        self.console.dvars['sv_hostname_extra'] = 'x'
+        self.subscriptions.subscribe('sv_hostname',self.callback)
+        self.subscriptions.poll(force=True)
+        self.console.dvars['sv_hostname_extra'] = 'y'
+        self.assertEqual(self.subscriptions.poll(force=True),[])
+
+    def test_quiet_query_backs_off_and_change_resets(self):
+        self.subscriptions.subscribe('sv_hostname',self.callback)
+        query = self.subscriptions._queries[0]
+        for interval in (2.0,4.0,8.0,8.0):
+            self.subscriptions.poll(force=True)
+            self.assertEqual(query.interval,interval)
+        self.console.dvars['sv_hostname'] = 'Renamed'
+        self.subscriptions.poll(force=True)
+        self.assertEqual(query.interval,1.0)
+
+    def test_only_due_queries_are_polled(self):
+        self.subscriptions.subscribe('sv_hostname',self.callback)
+        self.subscriptions.poll()
+        self.subscriptions.poll()
+        self.assertEqual(self.console.queries,['sv_hostname'])
+
+    def test_failed_query_is_retried_later(self):
+        self.subscriptions.subscribe('sv_hostname',self.callback)
+        self.console.dvars = None
+        self.assertEqual(self.subscriptions.poll(force=True),[])
+        self.assertGreater(self.subscriptions._queries[0].due,monotonic())
+
+    def test_unsubscribe_replans(self):
+        subscription = self.subscriptions.subscribe('sv_hostname',self.callback)
+        self.subscriptions.subscribe('g_gametype',self.callback)
+        self.subscriptions.unsubscribe(subscription)
+        self.assertEqual(self.subscriptions.queries,['g_gametype'])
+
+
+class SharedConsoleTest(unittest.TestCase):
+
+    def test_polling_thread_and_caller_share_a_console(self):
+        with FakeServer() as server:
+            console = RemoteConsole('secret','127.0.0.1',server.port)
+            subscriptions = DvarSubscriptions(console,interval=0.0)
+            subscriptions.subscribe('sv_hostname',lambda *change: None)
+            subscriptions.start()
+            try:
+                for _ in range(20):
+                    reply = console.send('status',timeout=0.02,retries=0)
+                    self.assertTrue(reply.startswith('map: mp_crash'))
+                sleep(0.1)
+            finally:
+                subscriptions.stop()
+            self.assertIn('dvardump sv_hostname',server.commands)
+
+
+if __name__ == '__main__':
+    unittest.main()